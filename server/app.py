@@ -1,22 +1,86 @@
+import time
+_boot_started = time.perf_counter()
+
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from dotenv import load_dotenv
+import importlib
 import logging  
 import os
-from routes.auth import auth_bp
-from routes.logo import logo_bp
-from routes.image import image_bp
-from routes.payment import payment_bp
-from routes.trends import trends_bp
-from routes.post import post_bp
-from routes.chat import chat_bp
-from routes.mercado_pago_integration import create_preference
-from routes.post_history import post_history_bp
-from routes.enhance import enhance_bp
-from data.db import init_db
+import sys
+from data.db import init_db, init_request_session, check_database
+from services import metrics
+_core_imports_ms = round((time.perf_counter() - _boot_started) * 1000, 1)
 
 load_dotenv()
 
+# (módulo, blueprint). Módulos pesados podem ser desligados com
+# DISABLED_BLUEPRINTS=enhance,trends para workers de API mais leves.
+BLUEPRINTS = [
+    ('routes.auth', 'auth_bp'),
+    ('routes.logo', 'logo_bp'),
+    ('routes.image', 'image_bp'),
+    ('routes.payment', 'payment_bp'),
+    ('routes.trends', 'trends_bp'),
+    ('routes.post', 'post_bp'),
+    ('routes.chat', 'chat_bp'),
+    ('routes.post_history', 'post_history_bp'),
+    ('routes.search', 'search_bp'),
+    ('routes.export', 'export_bp'),
+    ('routes.enhance', 'enhance_bp'),
+    ('routes.metrics', 'metrics_bp'),
+]
+
+# CORS compartilhado com as rotas assíncronas de asgi.py
+CORS_ORIGINS = ["http://localhost:5173"] # FRONT END URL
+CORS_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+CORS_ALLOW_HEADERS = ["Content-Type", "Authorization", "Access-Control-Allow-Credentials", "Idempotency-Key"]  # AUTHORIZATION
+CORS_EXPOSE_HEADERS = ["Content-Range", "X-Content-Range", "Retry-After", "Idempotent-Replayed", "X-Single-Flight"]
+
+# modules: tempo de import de cada blueprint, incluindo o que ele importou
+# primeiro (data.db etc. já vêm em core_imports_ms); imports_blueprints: um
+# blueprint que importa outro leva o custo dele, e o outro aparece com ~0 ms.
+# Para o detalhe por módulo: python -X importtime app.py
+startup_report = {'core_imports_ms': _core_imports_ms, 'modules': {}, 'imports_blueprints': {}, 'disabled': [], 'warm_up': {}}
+metrics.register('startup', lambda: startup_report)
+
+def register_blueprints(app):
+    """Import and register enabled blueprints, timing each module import."""
+    disabled = {name.strip() for name in os.getenv('DISABLED_BLUEPRINTS', '').split(',') if name.strip()}
+    modules = []
+    for module_name, attr in BLUEPRINTS:
+        short_name = module_name.rsplit('.', 1)[-1]
+        if short_name in disabled and short_name != 'auth':
+            startup_report['disabled'].append(short_name)
+            continue
+        already_loaded = set(sys.modules)
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        startup_report['modules'][short_name] = round((time.perf_counter() - start) * 1000, 1)
+        pulled_in = [
+            other.rsplit('.', 1)[-1] for other, _ in BLUEPRINTS
+            if other != module_name and other in sys.modules and other not in already_loaded
+        ]
+        if pulled_in:
+            startup_report['imports_blueprints'][short_name] = pulled_in
+        app.register_blueprint(getattr(module, attr))
+        modules.append(module)
+    return modules
+
+def warm_up(modules):
+    """Run the optional warm_up() hook of each module (DB, models, clients)."""
+    hooks = [('db', check_database)] + [
+        (module.__name__.rsplit('.', 1)[-1], module.warm_up)
+        for module in modules if hasattr(module, 'warm_up')
+    ]
+    for name, hook in hooks:
+        start = time.perf_counter()
+        try:
+            hook()
+        except Exception as e:
+            logging.exception(f"Warm-up of {name} failed: {e}")
+        startup_report['warm_up'][name] = round((time.perf_counter() - start) * 1000, 1)
+
 def create_app():
     app = Flask(__name__)
     
@@ -25,8 +89,9 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SQLALCHEMY_ECHO'] = True  # For debugging
 
-    # Initialize database
-    init_db()  # <-- Remove app argument
+    # O schema é mantido por migrations/migrate.py; create_all só se pedido
+    if os.getenv('DB_AUTO_CREATE', '0') == '1':
+        init_db()
 
     app.config.update(
         SECRET_KEY=os.getenv('SECRET_KEY', 'your-secret-key'),
@@ -38,27 +103,39 @@ def create_app():
     # Simplified CORS configuration
     CORS(app, supports_credentials=True, resources={
             r"/*": {
-                "origins": ["http://localhost:5173"], # FRONT END URL
-                "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-                "allow_headers": ["Content-Type", "Authorization", "Access-Control-Allow-Credentials"],  # AUTHORIZATION
-                "expose_headers": ["Content-Range", "X-Content-Range"],
+                "origins": CORS_ORIGINS,
+                "methods": CORS_METHODS,
+                "allow_headers": CORS_ALLOW_HEADERS,
+                "expose_headers": CORS_EXPOSE_HEADERS,
                 "supports_credentials": True
             }
         })
 
+    # Sessão do banco por requisição: commit no after_request, close no teardown
+    init_request_session(app)
+
     # Configuração do logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     # Register blueprints
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(logo_bp)
-    app.register_blueprint(image_bp)
-    app.register_blueprint(payment_bp)
-    app.register_blueprint(trends_bp)
-    app.register_blueprint(post_bp)
-    app.register_blueprint(chat_bp)
-    app.register_blueprint(post_history_bp)
-    app.register_blueprint(enhance_bp)
+    modules = register_blueprints(app)
+
+    # Autenticação centralizada: resolve o usuário uma vez por requisição em g.user
+    # (routes.auth já foi importado, e cronometrado, por register_blueprints)
+    from routes.auth import authenticate_request
+    app.before_request(authenticate_request)
+
+    # Carrega modelos/clientes/conexão antes do primeiro request, se pedido;
+    # também disponível sob demanda com `flask warmup`.
+    if os.getenv('WARMUP_ON_START', '0') == '1':
+        warm_up(modules)
+
+    @app.cli.command('warmup')
+    def warmup_command():
+        """Load lazily initialized resources and print their timings."""
+        warm_up(modules)
+        for name, ms in startup_report['warm_up'].items():
+            print(f"{name:<16} {ms:>8.1f} ms")
 
 
     # Tratamento de erros
@@ -72,6 +149,13 @@ def create_app():
         logging.error(f"Internal server error: {error}")
         return jsonify({'error': 'Internal server error'}), 500
 
+    startup_report['total_ms'] = round((time.perf_counter() - _boot_started) * 1000, 1)
+    logging.info(
+        f"Startup in {startup_report['total_ms']} ms; core imports {startup_report['core_imports_ms']} ms; "
+        f"module imports (ms): {startup_report['modules']}"
+        + (f"; blueprints imported by others: {startup_report['imports_blueprints']}" if startup_report['imports_blueprints'] else '')
+        + (f"; disabled: {startup_report['disabled']}" if startup_report['disabled'] else '')
+    )
     return app
 
 app = create_app()
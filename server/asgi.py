@@ -0,0 +1,424 @@
+"""ASGI entry point: async /chat/chat(/stream) and /post/generate(/batch), Flask for the rest.
+
+The LLM-bound endpoints run on the event loop with the async OpenAI
+client and the async SQLAlchemy engine, so one process can keep hundreds of
+upstream calls in flight. Every other route is the regular Flask app served
+through a WSGI adapter (thread pool of WSGI_THREADS).
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+`python app.py` / gunicorn keep serving the all-sync app as before.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import anyio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.background import BackgroundTask
+from werkzeug.utils import secure_filename
+from app import app as flask_app, CORS_ORIGINS, CORS_METHODS, CORS_ALLOW_HEADERS, CORS_EXPOSE_HEADERS
+from data.db import verify_token
+from services.chat_context import build_context
+from services.llm_cache import cached_completion_async, cache_bypassed
+from services.limiter import Overloaded
+from services.single_flight import (
+    COALESCED_HEADER, REPLAYED_HEADER, IdempotencyKeyReused, SingleFlightTimeout, deduplicate_async, idempotency_key,
+    stored_response
+)
+from services.llm_gateway import complete_async
+from services.uploads import UploadTooLarge, save_upload
+from data.async_db import save_chat_message_async, dispose_async_engine
+from routes import chat as chat_routes
+from routes import post as post_routes
+
+logger = logging.getLogger(__name__)
+
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', '10'))
+
+def overloaded_response(error):
+    """Same 503 as routes.errors.overloaded_response."""
+    return JSONResponse(
+        {'error': 'Server busy, please try again'}, status_code=503,
+        headers={'Retry-After': str(error.retry_after)}
+    )
+
+async def authenticate(request):
+    """Same checks as routes.auth.authenticate_request; returns (user, error)."""
+    token = request.cookies.get('session')
+    if not token:
+        return None, JSONResponse({'error': 'No authentication cookie'}, status_code=401)
+    # verify_token is usually a cache hit; misses query the DB in a thread
+    user = await run_in_threadpool(verify_token, token)
+    if user is None:
+        logger.warning(f"Invalid session for {request.method} {request.url.path}")
+        return None, JSONResponse({'error': 'Invalid session'}, status_code=401)
+    return user, None
+
+async def _start_chat(request, user):
+    """Async version of routes.chat._start_chat; returns (context, error)."""
+    form = await request.form()
+    prompt = (form.get('prompt') or '').strip()
+    image = form.get('image')
+    if not isinstance(image, UploadFile) or not image.filename:
+        image = None
+    conversation_id = form.get('conversation_id')
+
+    if not prompt and not image:
+        return None, JSONResponse({'error': 'Prompt or image is required'}, status_code=400)
+    if prompt and len(prompt) > 2000:
+        return None, JSONResponse({'error': 'Prompt is too long'}, status_code=400)
+
+    filename = None
+    prompt_for_ai = prompt
+    if image:
+        try:
+            filename = await run_in_threadpool(save_upload, image.file, image.filename)
+            prompt_for_ai = f"{prompt}\n[Imagem anexada: {secure_filename(image.filename) or filename}]"
+        except UploadTooLarge as e:
+            return None, JSONResponse({'error': str(e)}, status_code=413)
+        except Exception as e:
+            logger.error(f"Error saving image: {e}")
+            return None, JSONResponse({'error': 'Failed to save image'}, status_code=500)
+
+    summary, history = await run_in_threadpool(build_context, user.id, conversation_id, prompt_for_ai)
+
+    try:
+        conversation_id = conversation_id or str(uuid.uuid4())
+        await save_chat_message_async(
+            user_id=user.id,
+            role='user',
+            content=prompt,
+            conversation_id=conversation_id,
+            image_path=filename
+        )
+    except Exception as e:
+        logger.exception(f"Failed to save message: {str(e)}")
+        return None, JSONResponse({'error': f'Database error: {str(e)}'}, status_code=500)
+
+    return {
+        'prompt_for_ai': prompt_for_ai,
+        'summary': summary,
+        'history': history,
+        'conversation_id': conversation_id,
+        'image_path': filename
+    }, None
+
+async def request_payload(request):
+    """Same identity as routes.single_flight.request_payload."""
+    if request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+    # Starlette guarda o form já lido: a rota recebe o mesmo objeto
+    form = await request.form()
+    fields, files = [], []
+    for name, value in form.multi_items():
+        if isinstance(value, UploadFile):
+            digest = hashlib.sha256()
+            while chunk := await value.read(64 * 1024):
+                digest.update(chunk)
+            await value.seek(0)
+            files.append([name, value.filename, digest.hexdigest()])
+        else:
+            fields.append((name, value))
+    return {'form': sorted(fields), 'files': sorted(files)}
+
+def single_flight(endpoint):
+    """Async routes.single_flight.single_flight; ``endpoint`` is the Flask
+    endpoint name so both apps deduplicate under the same keys. Authenticates
+    the request and leaves the user on ``request.state.user`` for the route."""
+    def decorate(route):
+        async def wrapper(request):
+            user, error = await authenticate(request)
+            if error:
+                return error
+            request.state.user = user
+            try:
+                key = idempotency_key(request.headers)
+            except ValueError as e:
+                return JSONResponse({'error': str(e)}, status_code=400)
+
+            async def handler(fingerprint):
+                response = await route(request)
+                return stored_response(
+                    response.status_code, response.body.decode('utf-8'),
+                    response.headers.get('content-type'), response.headers, fingerprint
+                )
+
+            try:
+                stored, replayed, coalesced = await deduplicate_async(
+                    user.id, endpoint, await request_payload(request), key, handler
+                )
+            except IdempotencyKeyReused as e:
+                return JSONResponse({'error': str(e)}, status_code=422)
+            except SingleFlightTimeout:
+                return JSONResponse({'error': 'Timed out waiting for an identical request in progress'}, status_code=504)
+            headers = dict(stored['headers'])
+            if replayed:
+                headers[REPLAYED_HEADER] = 'true'
+            if coalesced:
+                headers[COALESCED_HEADER] = 'coalesced'
+            return Response(stored['body'], status_code=stored['status'], headers=headers, media_type=stored['content_type'])
+        return wrapper
+    return decorate
+
+@single_flight('chat.chat')
+async def chat(request):
+    """Async version of routes.chat.chat."""
+    try:
+        user = request.state.user
+        context, error = await _start_chat(request, user)
+        if error:
+            return error
+        conversation_id = context['conversation_id']
+
+        try:
+            # Images are resized/encoded here, off the event loop
+            args = await run_in_threadpool(
+                chat_routes.chat_completion_args,
+                context['prompt_for_ai'], context['summary'], context['history'], context['image_path']
+            )
+            try:
+                generated_text, duration_ms, cached = await cached_completion_async(
+                    args, use_cache=not cache_bypassed(request.headers)
+                )
+            except Overloaded as e:
+                return overloaded_response(e)
+
+            await save_chat_message_async(
+                user_id=user.id,
+                role='assistant',
+                content=generated_text,
+                conversation_id=conversation_id
+            )
+
+            return JSONResponse({
+                'model': args['model'],
+                'duration_ms': duration_ms,
+                'cached': cached,
+                'response': generated_text,
+                'conversation_id': conversation_id,
+                'image_path': context['image_path']
+            })
+
+        except Exception as e:
+            logger.error(f"Error in chat processing: {str(e)}")
+            return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+    except Exception as e:
+        logger.exception("Unexpected error in chat endpoint")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def chat_stream(request):
+    """Async version of routes.chat.chat_stream (same SSE events)."""
+    try:
+        user, error = await authenticate(request)
+        if error:
+            return error
+        context, error = await _start_chat(request, user)
+        if error:
+            return error
+        conversation_id = context['conversation_id']
+
+        args = await run_in_threadpool(
+            chat_routes.chat_completion_args,
+            context['prompt_for_ai'], context['summary'], context['history'], context['image_path']
+        )
+        start = time.time()
+        try:
+            stream = await complete_async(stream=True, **args)
+        except Overloaded as e:
+            return overloaded_response(e)
+
+        async def generate():
+            parts = []
+            try:
+                yield chat_routes.sse_event({'conversation_id': conversation_id, 'model': args['model']}, 'start')
+                ttft_ms = None
+                async for chunk in stream:
+                    text = chat_routes.chunk_text(chunk)
+                    if not text:
+                        continue
+                    if ttft_ms is None:
+                        ttft_ms = int((time.time() - start) * 1000)
+                    parts.append(text)
+                    yield chat_routes.sse_event({'delta': text})
+                yield chat_routes.sse_event({
+                    'ttft_ms': ttft_ms,
+                    'duration_ms': int((time.time() - start) * 1000),
+                    'conversation_id': conversation_id,
+                    'image_path': context['image_path']
+                }, 'done')
+            except (GeneratorExit, anyio.get_cancelled_exc_class()):
+                logger.info(f"Client disconnected from chat stream {conversation_id}")
+                raise
+            except Exception as e:
+                logger.error(f"Error in chat stream: {str(e)}")
+                yield chat_routes.sse_event({'error': 'Internal server error'}, 'error')
+            finally:
+                # Shielded: on disconnect this task is being cancelled
+                with anyio.CancelScope(shield=True):
+                    await stream.close()
+                    if parts:
+                        try:
+                            await save_chat_message_async(
+                                user_id=user.id, role='assistant', content=''.join(parts), conversation_id=conversation_id
+                            )
+                        except Exception as e:
+                            logger.exception(f"Failed to save streamed assistant message: {str(e)}")
+
+        # background: releases the limiter slot even if generate() never runs
+        return StreamingResponse(
+            generate(), media_type='text/event-stream', headers=chat_routes.SSE_HEADERS,
+            background=BackgroundTask(stream.close)
+        )
+
+    except Exception as e:
+        logger.exception("Unexpected error in chat stream endpoint")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@single_flight('post.generate_post')
+async def generate_post(request):
+    """Async version of routes.post.generate_post."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'topic' not in data:
+        return JSONResponse({'error': 'Topic is required'}, status_code=400)
+
+    try:
+        content, duration_ms, cached = await cached_completion_async(
+            post_routes.post_completion_args(data),
+            use_cache=not cache_bypassed(request.headers)
+        )
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.exception("Error generating post")
+        return JSONResponse({'error': str(e)}, status_code=500)
+    return JSONResponse({'content': content, 'cached': cached})
+
+async def run_batch(variants, use_cache):
+    """Async routes.post.run_batch: results in completion order, bounded by a semaphore."""
+    start = time.time()
+    semaphore = asyncio.Semaphore(post_routes.POST_BATCH_CONCURRENCY)
+
+    async def run_variant(index, variant):
+        async with semaphore:
+            try:
+                content, duration_ms, cached = await cached_completion_async(
+                    post_routes.post_completion_args(variant), use_cache=use_cache
+                )
+                return post_routes.variant_result(index, variant, start, content, duration_ms, cached)
+            except Exception as e:
+                logger.warning(f"Post variant {index} failed: {e.__class__.__name__}: {e}")
+                return post_routes.variant_result(index, variant, start, error=post_routes.variant_error(e))
+
+    tasks = [asyncio.create_task(run_variant(index, variant)) for index, variant in enumerate(variants)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def read_batch(request):
+    """Authenticate and parse a batch request; returns (variants, error response)."""
+    user, error = await authenticate(request)
+    if error:
+        return None, error
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    variants, message = post_routes.parse_batch(data)
+    if message:
+        return None, JSONResponse({'error': message}, status_code=400)
+    return variants, None
+
+async def generate_post_batch(request):
+    """Async version of routes.post.generate_post_batch."""
+    try:
+        variants, error = await read_batch(request)
+        if error:
+            return error
+        start = time.time()
+        results = [result async for result in run_batch(variants, not cache_bypassed(request.headers))]
+        results.sort(key=lambda result: result['index'])
+        return JSONResponse({'results': results, **post_routes.batch_summary(results, start)})
+
+    except Exception as e:
+        logger.exception("Error generating post batch")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def generate_post_batch_stream(request):
+    """Async version of routes.post.generate_post_batch_stream."""
+    try:
+        variants, error = await read_batch(request)
+        if error:
+            return error
+        use_cache = not cache_bypassed(request.headers)
+
+        async def generate():
+            start = time.time()
+            results = []
+            yield chat_routes.sse_event({'variants': len(variants)}, 'start')
+            batch = run_batch(variants, use_cache)
+            try:
+                async for result in batch:
+                    results.append(result)
+                    yield chat_routes.sse_event(result, 'variant')
+            finally:
+                await batch.aclose()
+            yield chat_routes.sse_event(post_routes.batch_summary(results, start), 'done')
+
+        return StreamingResponse(generate(), media_type='text/event-stream', headers=chat_routes.SSE_HEADERS)
+
+    except Exception as e:
+        logger.exception("Error generating post batch")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await dispose_async_engine()
+
+# CORS só nas rotas assíncronas; as rotas Flask já respondem com Flask-CORS
+async_routes = CORSMiddleware(
+    Starlette(routes=[
+        Route('/chat/chat', chat, methods=['POST']),
+        Route('/chat/chat/stream', chat_stream, methods=['POST']),
+        Route('/post/generate', generate_post, methods=['POST']),
+        Route('/post/generate/batch', generate_post_batch, methods=['POST']),
+        Route('/post/generate/batch/stream', generate_post_batch_stream, methods=['POST']),
+    ]),
+    allow_origins=CORS_ORIGINS,
+    allow_methods=CORS_METHODS,
+    allow_headers=CORS_ALLOW_HEADERS,
+    expose_headers=CORS_EXPOSE_HEADERS,
+    allow_credentials=True
+)
+
+app = Starlette(
+    routes=[
+        Route('/chat/chat', async_routes),
+        Route('/chat/chat/stream', async_routes),
+        Route('/post/generate', async_routes),
+        Route('/post/generate/batch', async_routes),
+        Route('/post/generate/batch/stream', async_routes),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,102 @@
+"""Benchmark: NDJSON export throughput and memory on a synthetic history.
+
+Usage:
+    python benchmarks/ndjson_export.py [--rows 1000000] [--database-url URL] [--keep] [--no-memory]
+
+Fills a scratch database (a temporary SQLite file unless --database-url is
+given) with ``--rows`` chat messages for one user, then streams the export
+through data.export, plain and gzipped. Reports rows/sec, MB/sec and output
+size, then (in a second, slower pass under tracemalloc) the peak Python
+memory of the export, which must stay flat as --rows grows.
+"""
+import sys
+import os
+import time
+import uuid
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INSERT_BATCH = 10000
+MESSAGES_PER_CONVERSATION = 50
+
+def populate(rows, user_id):
+    from data.db import ChatMessage, get_engine, init_db
+    init_db()
+    engine = get_engine()
+    table = ChatMessage.__table__
+    started = datetime(2024, 1, 1)
+    start = time.perf_counter()
+    conversation_id = None
+    with engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.user_id == user_id))
+    for offset in range(0, rows, INSERT_BATCH):
+        batch = []
+        for i in range(offset, min(rows, offset + INSERT_BATCH)):
+            if i % MESSAGES_PER_CONVERSATION == 0:
+                conversation_id = str(uuid.uuid4())
+            batch.append({
+                'user_id': user_id,
+                'conversation_id': conversation_id,
+                'role': 'user' if i % 2 == 0 else 'assistant',
+                'content': f"Mensagem {i}: como escrever um post sobre marketing digital para pequenas empresas? " * (1 + i % 3),
+                'image_path': None,
+                'created_at': started + timedelta(seconds=i)
+            })
+        with engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+    print(f"populated {rows} rows in {time.perf_counter() - start:.1f}s")
+
+def export_size(user_id, compress):
+    from data.export import export_stream
+    size = 0
+    for chunk in export_stream(user_id, sections=('chat_messages',), compress=compress):
+        size += len(chunk)
+    return size
+
+def run(user_id, rows, compress, trace_memory):
+    start = time.perf_counter()
+    size = export_size(user_id, compress)
+    elapsed = time.perf_counter() - start
+    peak = ''
+    if trace_memory:
+        # tracemalloc slows the export several times: measured separately
+        tracemalloc.start()
+        export_size(user_id, compress)
+        peak = f"{tracemalloc.get_traced_memory()[1] / 1e6:.1f}"
+        tracemalloc.stop()
+    label = 'ndjson.gz' if compress else 'ndjson'
+    print(f"{label:<10} {rows / elapsed:>12.0f} {size / elapsed / 1e6:>8.1f} {size / 1e6:>9.1f} {peak:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--database-url', help="Scratch database to fill (default: a temporary SQLite file).")
+    parser.add_argument('--user-id', type=int, default=999999)
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary SQLite file.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc pass.")
+    args = parser.parse_args()
+
+    path = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        fd, path = tempfile.mkstemp(suffix='.db', prefix='export-bench-')
+        os.close(fd)
+        os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+    # Sem réplicas: o benchmark mede só a base informada
+    os.environ['DATABASE_REPLICA_URLS'] = ''
+
+    try:
+        populate(args.rows, args.user_id)
+        print(f"{'format':<10} {'rows/s':>12} {'MB/s':>8} {'size MB':>9} {'peak MB':>10}")
+        run(args.user_id, args.rows, compress=False, trace_memory=not args.no_memory)
+        run(args.user_id, args.rows, compress=True, trace_memory=not args.no_memory)
+    finally:
+        if path and not args.keep:
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
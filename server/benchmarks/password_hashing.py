@@ -0,0 +1,63 @@
+"""Micro-benchmark: password verifications (logins) per second per core.
+
+Usage:
+    python benchmarks/password_hashing.py [--seconds 2] [--methods m1,m2,...]
+
+For each werkzeug hash method it reports the single-thread verification
+rate (logins/sec/core) and the aggregate rate through PasswordHasher with
+one worker per CPU, which is what a worker process can sustain.
+"""
+import sys
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from services.passwords import PasswordHasher
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'scrypt:32768:8:1',
+]
+
+def single_core_rate(password_hash, password, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        check_password_hash(password_hash, password)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def pool_rate(method, password_hash, password, seconds, workers):
+    hasher = PasswordHasher(method=method, workers=workers, queue_limit=workers * 4)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers * 2) as callers:
+        while time.perf_counter() < deadline:
+            list(callers.map(lambda _: hasher.verify(password_hash, password), range(workers * 2)))
+            count += workers * 2
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--methods', default=','.join(DEFAULT_METHODS))
+    args = parser.parse_args()
+
+    workers = os.cpu_count() or 1
+    password = 'correct horse battery staple'
+    print(f"{'method':<24} {'ms/login':>9} {'logins/s/core':>14} {f'pool x{workers} logins/s':>20}")
+    for method in args.methods.split(','):
+        password_hash = generate_password_hash(password, method=method)
+        per_core = single_core_rate(password_hash, password, args.seconds)
+        pooled = pool_rate(method, password_hash, password, args.seconds, workers)
+        print(f"{method:<24} {1000 / per_core:>9.1f} {per_core:>14.1f} {pooled:>20.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from data.db import DATABASE_URL, prepare_chat_message, submit_chat_message, insert_chat_message
+
+logger = logging.getLogger(__name__)
+
+# Engine assíncrono usado pelo modo ASGI (asgi.py). Reaproveita DATABASE_URL
+# trocando o driver: postgresql -> asyncpg, sqlite -> aiosqlite.
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', '10'))
+
+_async_engine = None
+_async_session_factory = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+def to_async_url(url):
+    """Map a sync database URL to its asyncio driver."""
+    scheme, sep, rest = url.partition('://')
+    if scheme in ('postgres', 'postgresql', 'postgresql+psycopg2'):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme == 'sqlite':
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        url = ASYNC_DATABASE_URL or (DATABASE_URL and to_async_url(DATABASE_URL))
+        if not url:
+            raise ValueError("DATABASE_URL is required")
+        options = {'pool_pre_ping': True}
+        if not url.startswith('sqlite'):
+            options['pool_size'] = ASYNC_DB_POOL_SIZE
+        _async_engine = create_async_engine(url, **options)
+        _async_session_factory.configure(bind=_async_engine)
+    return _async_engine
+
+@asynccontextmanager
+async def async_session_scope():
+    """Async counterpart of data.db.session_scope(): commit, rollback, close."""
+    get_async_engine()
+    session = _async_session_factory()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+async def save_chat_message_async(user_id, role, content, **kwargs):
+    """Same contract as data.db.save_chat_message, without blocking the loop."""
+    try:
+        row = prepare_chat_message(user_id, role, content, **kwargs)
+
+        if not kwargs.get('sync'):
+            queued = submit_chat_message(row)
+            if queued:
+                return queued
+
+        async with async_session_scope() as session:
+            # The ORM insert and the conversations upsert are shared with the
+            # sync helper; run_sync drives them over the async connection.
+            saved = await session.run_sync(insert_chat_message, row)
+
+        logger.info(f"Message saved successfully: id={saved['id']}")
+        return saved
+
+    except Exception as e:
+        logger.exception(f"Error in save_chat_message_async: {str(e)}")
+        raise
+
+async def dispose_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
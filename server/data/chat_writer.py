@@ -0,0 +1,166 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from sqlalchemy import insert
+from data.db import ChatMessage, session_scope, touch_conversation
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Write-behind opcional para mensagens do chat: as mensagens entram numa fila
+# em memória e são gravadas em lotes (um INSERT multi-linha + um commit).
+# Mensagens ainda na fila podem ser perdidas se o processo morrer sem
+# shutdown limpo; por isso o modo é opt-in.
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', '0') == '1'
+CHAT_WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('CHAT_WRITE_BEHIND_QUEUE_SIZE', '10000'))
+CHAT_WRITE_BEHIND_MAX_BATCH = int(os.getenv('CHAT_WRITE_BEHIND_MAX_BATCH', '200'))
+CHAT_WRITE_BEHIND_MAX_DELAY_MS = int(os.getenv('CHAT_WRITE_BEHIND_MAX_DELAY_MS', '200'))
+CHAT_WRITE_BEHIND_FLUSH_ON_SHUTDOWN = os.getenv('CHAT_WRITE_BEHIND_FLUSH_ON_SHUTDOWN', '1') == '1'
+CHAT_WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv('CHAT_WRITE_BEHIND_SHUTDOWN_TIMEOUT', '10'))
+CHAT_WRITE_BEHIND_RETRIES = 3
+
+
+class ChatMessageWriter:
+    """Bounded queue plus a daemon thread that inserts chat messages in batches.
+
+    A batch is flushed when it reaches ``max_batch`` messages or when its
+    oldest message has waited ``max_delay_ms``. ``submit`` never blocks: if
+    the queue is full it returns False and the caller writes synchronously.
+    """
+
+    def __init__(self, enabled=CHAT_WRITE_BEHIND, queue_size=CHAT_WRITE_BEHIND_QUEUE_SIZE,
+                 max_batch=CHAT_WRITE_BEHIND_MAX_BATCH, max_delay_ms=CHAT_WRITE_BEHIND_MAX_DELAY_MS):
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+                self._thread.start()
+
+    def submit(self, row):
+        if not self.enabled or self._stop.is_set():
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.rejected += 1
+            logger.warning("Chat write-behind queue full; writing synchronously")
+            return False
+        self.enqueued += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                # Parando: não bloqueia mais, sai quando a fila esvaziar
+                first = self._queue.get(block=not self._stop.is_set())
+            except queue.Empty:
+                return
+            if first is None:
+                self._queue.task_done()
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch):
+        for attempt in range(1, CHAT_WRITE_BEHIND_RETRIES + 1):
+            try:
+                with session_scope() as session:
+                    session.execute(insert(ChatMessage.__table__), batch)
+                    for key, rows in self._group_by_conversation(batch).items():
+                        user_id, conversation_id = key
+                        titles = [r['content'] for r in rows if r['role'] == 'user']
+                        last = rows[-1]
+                        touch_conversation(
+                            session, user_id, conversation_id, last['role'], last['content'],
+                            last['created_at'], count=len(rows), title=titles[0] if titles else None
+                        )
+                self.flushed += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                logger.exception(f"Chat write-behind flush failed (attempt {attempt}): {e}")
+                time.sleep(0.1 * 2 ** attempt)
+        self.failed += len(batch)
+        logger.error(f"Dropped {len(batch)} chat messages after {CHAT_WRITE_BEHIND_RETRIES} attempts")
+
+    @staticmethod
+    def _group_by_conversation(batch):
+        groups = {}
+        for row in batch:
+            groups.setdefault((row['user_id'], row['conversation_id']), []).append(row)
+        return groups
+
+    def flush(self):
+        """Block until every message queued so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout=CHAT_WRITE_BEHIND_SHUTDOWN_TIMEOUT):
+        """Stop accepting messages and drain the queue for at most ``timeout`` seconds."""
+        self._stop.set()
+        if self._thread is None:
+            return
+        try:
+            # Acorda o flusher parado no get(); com a fila cheia ele não está parado
+            self._queue.put_nowait(None)
+            sentinel = 1
+        except queue.Full:
+            sentinel = 0
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            dropped = max(0, self._queue.qsize() - sentinel)
+            logger.error(f"Chat write-behind did not drain within {timeout}s; dropping {dropped} queued messages")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'queue_depth': self._queue.qsize(),
+            'enqueued': self.enqueued,
+            'sync_fallbacks': self.rejected,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failed': self.failed
+        }
+
+
+chat_writer = ChatMessageWriter()
+metrics.register('chat_write_behind', chat_writer.stats)
+if CHAT_WRITE_BEHIND_FLUSH_ON_SHUTDOWN:
+    atexit.register(chat_writer.close)
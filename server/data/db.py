@@ -1,13 +1,25 @@
 import logging
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text, Column, Integer, String, Text, Float, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, text, Column, Integer, String, Text, Float, DateTime, ForeignKey, Index, func, or_, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from flask import g, has_request_context, jsonify, request
+from contextlib import contextmanager
 from sqlalchemy.exc import OperationalError
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import namedtuple
+import base64
+import hashlib
+import json
+import threading
+import time
 import uuid
+from data.cache import TTLCache
+from services import metrics
+from services.passwords import hash_password, verify_password
 
 # Configuração do Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,24 +30,164 @@ load_dotenv()
 
 # Configurações do banco de dados
 DATABASE_URL = os.getenv('DATABASE_URL')
-if not DATABASE_URL:
-    logger.error("DATABASE_URL not found in environment variables")
-    raise ValueError("DATABASE_URL is required")
-
-try:
-    engine = create_engine(DATABASE_URL)
-    with engine.connect() as connection:
-        connection.execute(text("SELECT 1"))  # Changed from Text to text
-        connection.commit()
-    logger.info("Database connection established successfully.")
-except OperationalError as e:
-    logger.error(f"Database connection error: {e}")
-    raise SystemExit("Critical database connection failure.") from e
-except Exception as e:
-    raise SystemExit("Erro na inicialização do banco de dados.") from e
+
+# The engine is created on first use: importing this module never touches the
+# database, so a DB blip cannot crash worker boot.
+_engine = None
+_engine_lock = threading.Lock()
 
 Base = declarative_base()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: helpers return ORM objects that are read after commit
+_session_factory = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+
+def _enable_sqlite_savepoints(engine):
+    """pysqlite begins transactions lazily, which breaks SAVEPOINT; let
+    SQLAlchemy emit BEGIN itself (the recipe from the SQLAlchemy docs)."""
+
+    @event.listens_for(engine, 'connect')
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _emit_begin(conn):
+        if conn.get_execution_options().get('isolation_level') != 'AUTOCOMMIT':
+            conn.exec_driver_sql('BEGIN')
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if not DATABASE_URL:
+                    logger.error("DATABASE_URL not found in environment variables")
+                    raise ValueError("DATABASE_URL is required")
+                _engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+                if _engine.dialect.name == 'sqlite':
+                    _enable_sqlite_savepoints(_engine)
+                _session_factory.configure(bind=_engine)
+    return _engine
+
+def SessionLocal():
+    get_engine()
+    return _session_factory()
+
+# Réplicas de leitura opcionais (lista separada por vírgulas). Os helpers de
+# leitura usam read_session_scope(); escritas e leituras que precisam ver a
+# própria escrita continuam no primário.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_EJECT_SECONDS = int(os.getenv('REPLICA_EJECT_SECONDS', '30'))
+# Depois de uma escrita, as leituras do mesmo cliente ficam no primário por
+# este tempo (cookie), cobrindo o atraso de replicação entre requisições.
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+REPLICA_STICKY_COOKIE = 'db_primary_until'
+
+class ReplicaPool:
+    """Round-robin over replica engines, ejecting a replica for a while after
+    a connection failure so reads fail over to the others (or the primary)."""
+
+    def __init__(self, urls, eject_seconds=REPLICA_EJECT_SECONDS):
+        self.urls = urls
+        self.eject_seconds = eject_seconds
+        self._engines = [None] * len(urls)
+        self._ejected_until = [0.0] * len(urls)
+        self._reads = [0] * len(urls)
+        self._next = 0
+        self._lock = threading.Lock()
+        self.ejections = 0
+        self.primary_fallbacks = 0
+
+    def __bool__(self):
+        return bool(self.urls)
+
+    def _engine(self, index):
+        """Engine of replica ``index``, created on first use; None (and the
+        replica ejected) if it can't be, e.g. a bad URL or a missing driver."""
+        engine = self._engines[index]
+        if engine is not None:
+            return engine
+        try:
+            engine = create_engine(self.urls[index], pool_pre_ping=True)
+        except Exception as e:
+            logger.error(f"Read replica #{index} unusable: {e}")
+            self.eject(index)
+            return None
+        with self._lock:
+            if self._engines[index] is None:
+                self._engines[index] = engine
+                return engine
+        engine.dispose()
+        return self._engines[index]
+
+    def _next_healthy(self, exclude):
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.urls)):
+                index = self._next
+                self._next = (self._next + 1) % len(self.urls)
+                if index not in exclude and self._ejected_until[index] <= now:
+                    return index
+            self.primary_fallbacks += 1
+            return None
+
+    def choose(self, exclude=()):
+        """Return (index, engine) of the next healthy replica, or None."""
+        exclude = set(exclude)
+        while True:
+            index = self._next_healthy(exclude)
+            if index is None:
+                return None
+            engine = self._engine(index)
+            if engine is not None:
+                with self._lock:
+                    self._reads[index] += 1
+                return index, engine
+            exclude.add(index)
+
+    def eject(self, index):
+        with self._lock:
+            self._ejected_until[index] = time.monotonic() + self.eject_seconds
+            self.ejections += 1
+        logger.warning(f"Read replica #{index} ejected for {self.eject_seconds}s")
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'replicas': len(self.urls),
+            'healthy': sum(1 for until in self._ejected_until if until <= now),
+            'reads': list(self._reads),
+            'ejections': self.ejections,
+            'primary_fallbacks': self.primary_fallbacks
+        }
+
+replicas = ReplicaPool(DATABASE_REPLICA_URLS)
+metrics.register('read_replicas', replicas.stats)
+
+def check_database():
+    """Warm-up hook: open a pooled connection and run ``SELECT 1``."""
+    try:
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+        logger.info("Database connection established successfully.")
+        return True
+    except OperationalError as e:
+        logger.error(f"Database connection error: {e}")
+        return False
+
+# Cache em memória de token -> identidade do usuário, para evitar uma consulta
+# em `users` a cada requisição autenticada. O TTL limita por quanto tempo um
+# token revogado em outro worker ainda pode ser aceito por este processo.
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '60'))
+TOKEN_CACHE_MAX_SIZE = int(os.getenv('TOKEN_CACHE_MAX_SIZE', '10000'))
+
+# Duração da sessão no servidor; deve ser igual ao max_age do cookie 'session'
+SESSION_MAX_AGE = int(os.getenv('SESSION_MAX_AGE', '3600'))
+SESSION_PURGE_BATCH_SIZE = int(os.getenv('SESSION_PURGE_BATCH_SIZE', '1000'))
+
+# Lightweight identity returned by verify_token (safe to share across threads)
+SessionUser = namedtuple('SessionUser', ['id', 'username'])
+
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL)
+metrics.register('token_cache', _token_cache.stats)
  
 
  #Models
@@ -46,13 +198,32 @@ class User(Base):
     username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False)
     password_hash = Column(String, nullable=False)
-    token = Column(Text, nullable=True)
+    token = Column(Text, nullable=True)  # Legacy: sessions now live in user_sessions
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+class UserSession(Base):
+    __tablename__ = 'user_sessions'
+
+    # SHA-256 of the cookie token; the raw token is never stored
+    token_hash = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class SessionRevocation(Base):
+    __tablename__ = 'session_revocations'
+
+    # One revoked signed token (jti). Rows are only needed until expires_at.
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(32), unique=True, nullable=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
 
 class Logo(Base):
     __tablename__ = 'logos'
@@ -64,7 +235,9 @@ class Logo(Base):
     style = Column(String)
     color = Column(String)
     image_url = Column(String, nullable=False)
-    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+Index('ix_logos_user_created', Logo.user_id, Logo.created_at.desc(), Logo.id.desc())
 
 class Image(Base):
     __tablename__ = 'images'
@@ -74,7 +247,9 @@ class Image(Base):
     prompt = Column(String, nullable=False)
     style = Column(String)
     image_url = Column(String, nullable=False)
-    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+Index('ix_images_user_created', Image.user_id, Image.created_at.desc(), Image.id.desc())
 
 class Payment(Base):
     __tablename__ = 'payments'
@@ -84,8 +259,8 @@ class Payment(Base):
     amount = Column(Float, nullable=False)
     status = Column(String, nullable=False, default='pending')
     external_reference = Column(String, unique=True)
-    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
-    updated_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 class ChatMessage(Base):
     __tablename__ = 'chat_messages'
@@ -96,8 +271,37 @@ class ChatMessage(Base):
     role = Column(String, nullable=False)  # "user" ou "assistant"
     content = Column(Text, nullable=False)
     image_path = Column(String(255), nullable=True)
-    created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
-    
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves history, conversation listing and keyset message pages
+        Index('ix_chat_messages_user_conversation_created', 'user_id', 'conversation_id', 'created_at', 'id'),
+    )
+
+CONVERSATION_TITLE_LENGTH = 120
+CONVERSATION_PREVIEW_LENGTH = 200
+
+class Conversation(Base):
+    """Per-conversation summary row kept in sync by save_chat_message."""
+    __tablename__ = 'conversations'
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    title = Column(String(CONVERSATION_TITLE_LENGTH), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_message_at = Column(DateTime, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)
+    last_message_preview = Column(String(CONVERSATION_PREVIEW_LENGTH), nullable=True)
+    # Resumo incremental das mensagens antigas (até summary_until_id), usado
+    # para montar o contexto do chat dentro do orçamento de tokens
+    summary = Column(Text, nullable=True)
+    summary_until_id = Column(Integer, nullable=True)
+    summary_updated_at = Column(DateTime, nullable=True)
+
+Index(
+    'ix_conversations_user_last_message',
+    Conversation.user_id, Conversation.last_message_at.desc(), Conversation.id.desc()
+)
 
 class PostGenerator(Base):
     __tablename__ = 'chat_messages_post_generator'
@@ -119,454 +323,1016 @@ class Post(Base):
     word_count = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+Index('ix_posts_user_created', Post.user_id, Post.created_at.desc(), Post.id.desc())
+
+class LLMCacheEntry(Base):
+    """Shared tier of services.llm_cache (LLM_CACHE_SHARED=db) and of
+    services.single_flight idempotency records (IDEMPOTENCY_SHARED=db)."""
+    __tablename__ = 'llm_cache'
+
+    key = Column(String(64), primary_key=True)
+    value = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 def init_db():
     try:
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
+        # Busca textual: tabelas FTS5 / índices GIN ficam fora dos modelos
+        from data.search import create_search_schema
+        with get_engine().begin() as connection:
+            create_search_schema(connection)
         logger.info("Tabelas do banco de dados criadas (se necessário).")
     except Exception as e:
         logger.exception(f"Erro ao criar as tabelas do banco de dados: {e}")
         raise
 
-def get_user_by_username(username):
+@event.listens_for(_session_factory, 'do_orm_execute')
+def _mark_write_statement(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(_session_factory, 'after_flush')
+def _mark_write_flush(session, flush_context):
+    session.info['wrote'] = True
+
+def _get_request_session():
+    if '_db_session' not in g:
+        g._db_session = SessionLocal()
+    return g._db_session
+
+def _request_wrote():
+    session = g.get('_db_session')
+    return session is not None and session.info.get('wrote', False)
+
+def _stick_to_primary():
+    """True when this request (or this client, recently) wrote to the primary."""
+    if _request_wrote():
+        return True
+    try:
+        return float(request.cookies.get(REPLICA_STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def _open_replica_session():
+    tried = set()
+    while True:
+        chosen = replicas.choose(exclude=tried)
+        if chosen is None:
+            return None
+        index, engine = chosen
+        session = _session_factory(bind=engine)
+        try:
+            # Conecta já aqui para poder trocar de réplica antes da consulta
+            session.connection()
+            return session
+        except OperationalError as e:
+            session.close()
+            logger.error(f"Read replica #{index} unavailable: {e}")
+            replicas.eject(index)
+            tried.add(index)
+
+@contextmanager
+def read_session_scope():
+    """Session for read-only helpers.
+
+    Routed to a read replica when DATABASE_REPLICA_URLS is set, unless the
+    current request already wrote (or the client wrote within
+    REPLICA_STICKY_SECONDS); otherwise identical to session_scope().
+    """
+    in_request = has_request_context()
+    if not replicas or (in_request and _stick_to_primary()):
+        with session_scope() as session:
+            yield session
+        return
+
+    session = g.get('_db_read_session') if in_request else None
+    if session is None:
+        session = _open_replica_session()
+        if session is None:
+            with session_scope() as session:
+                yield session
+            return
+        if in_request:
+            g._db_read_session = session
+
+    try:
+        yield session
+    finally:
+        if not in_request:
+            session.close()
+
+@contextmanager
+def session_scope():
+    """Session used by the helpers below.
+
+    Inside a Flask request every helper shares one lazily created session
+    (one pooled connection, one transaction); each helper runs in a SAVEPOINT
+    so a failing helper only undoes its own work, and everything is committed
+    once by the after_request hook installed by init_request_session.
+    Outside a request (scripts, background threads) a private session is
+    opened, committed and closed around each helper call.
+    """
+    if has_request_context():
+        session = _get_request_session()
+        with session.begin_nested():
+            yield session
+        return
+
     session = SessionLocal()
     try:
-        user = session.query(User).filter(User.username == username).first()
-        if user:
-            logger.debug(f"Usuário {username} encontrado.")
-        else:
-            logger.debug(f"Usuário {username} não encontrado.")
-        return user
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def commit_request_session():
+    """Commit the request session now and hand its connection back to the pool.
+
+    Call this before slow upstream work (e.g. LLM calls) so the request does
+    not hold a connection idle in transaction; later helpers transparently
+    start a new transaction.
+    """
+    if not has_request_context():
+        return
+    session = g.get('_db_session')
+    if session is not None:
+        session.commit()
+
+def init_request_session(app):
+    """Register the hooks that commit and remove the request-scoped session."""
+
+    @app.after_request
+    def _commit_db_session(response):
+        session = g.get('_db_session')
+        if session is not None:
+            try:
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.exception(f"Erro ao confirmar a transação da requisição: {e}")
+                return jsonify({'error': 'Internal server error'}), 500
+            if replicas and session.info.get('wrote') and REPLICA_STICKY_SECONDS > 0:
+                response.set_cookie(
+                    REPLICA_STICKY_COOKIE, str(time.time() + REPLICA_STICKY_SECONDS),
+                    max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax'
+                )
+        return response
+
+    @app.teardown_request
+    def _remove_db_session(exc):
+        session = g.pop('_db_session', None)
+        if session is not None:
+            if exc is not None:
+                session.rollback()
+            session.close()
+        read_session = g.pop('_db_read_session', None)
+        if read_session is not None:
+            read_session.close()
+
+def get_user_by_username(username):
+    try:
+        with session_scope() as session:
+            user = session.query(User).filter(User.username == username).first()
+            if user:
+                logger.debug(f"Usuário {username} encontrado.")
+            else:
+                logger.debug(f"Usuário {username} não encontrado.")
+            return user
     except Exception as e:
         logger.exception(f"Erro ao buscar usuário por nome de usuário: {e}")
         return None
-    finally:
-        session.close()
 
 def create_user(username, email, password):
-    session = SessionLocal()
+    # Hash outside the session so PasswordHasherBusy reaches the route (503)
+    password_hash = hash_password(password)
     try:
-        user = User(username=username, email=email)
-        user.set_password(password)
-        session.add(user)
-        session.commit()
+        with session_scope() as session:
+            user = User(username=username, email=email, password_hash=password_hash)
+            session.add(user)
         logger.info(f"Usuário {username} criado com sucesso.")
         return user
     except Exception as e:
-        session.rollback()
         logger.exception(f"Erro ao criar usuário {username}: {e}")
         return None
-    finally:
-        session.close()
 
-def update_user_token(username, token):
-    session = SessionLocal()
+def update_password_hash(user_id, password_hash):
     try:
-        user = session.query(User).filter(User.username == username).first()
-        if user:
-            user.token = token
-            session.commit()
-            logger.info(f"Token do usuário {username} atualizado.")
-            return user
-        else:
-            logger.warning(f"Usuário {username} não encontrado ao atualizar o token.")
-            return None
+        with session_scope() as session:
+            updated = session.query(User).filter(User.id == user_id).update(
+                {User.password_hash: password_hash}, synchronize_session=False
+            )
+            return updated > 0
     except Exception as e:
-        session.rollback()
-        logger.exception(f"Erro ao atualizar token do usuário {username}: {e}")
+        logger.exception(f"Erro ao atualizar hash de senha do usuário {user_id}: {e}")
+        return False
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def is_signed_token(token):
+    # Signed tokens are JWTs (header.payload.signature); opaque database
+    # tokens from secrets.token_urlsafe never contain a dot.
+    return token.count('.') == 2
+
+def create_user_session(username, token, max_age=SESSION_MAX_AGE):
+    """Create a new server-side session for ``username``.
+
+    Each login creates its own row, so a user may be signed in on several
+    devices at once.
+    """
+    try:
+        with session_scope() as session:
+            user_id = session.query(User.id).filter(User.username == username).scalar()
+            if user_id is None:
+                logger.warning(f"Usuário {username} não encontrado ao criar sessão.")
+                return None
+            expires_at = datetime.utcnow() + timedelta(seconds=max_age)
+            session.add(UserSession(
+                token_hash=hash_token(token),
+                user_id=user_id,
+                expires_at=expires_at
+            ))
+        logger.info(f"Sessão criada para o usuário {username}.")
+        return SessionUser(id=user_id, username=username)
+    except Exception as e:
+        logger.exception(f"Erro ao criar sessão do usuário {username}: {e}")
         return None
-    finally:
-        session.close()
 
 def verify_token(token):
-    session = SessionLocal()
+    if not token:
+        return None
+
+    if is_signed_token(token):
+        from data.signed_sessions import verify_signed_token
+        return verify_signed_token(token)
+
+    token_hash = hash_token(token)
+    cached = _token_cache.get(token_hash)
+    if cached is not None:
+        return cached
+
     try:
-        user = session.query(User).filter(User.token == token).first()
-        if user:
-            logger.debug(f"Token {token} verificado para o usuário {user.username}.")
+        with session_scope() as session:
+            now = datetime.utcnow()
+            # Primary-key lookup on user_sessions; expired rows are filtered out
+            # before the join reaches the users table.
+            row = session.query(User.id, User.username, UserSession.expires_at)\
+                .join(UserSession, UserSession.user_id == User.id)\
+                .filter(
+                    UserSession.token_hash == token_hash,
+                    UserSession.expires_at > now
+                )\
+                .first()
+        if row:
+            user = SessionUser(id=row.id, username=row.username)
+            remaining = (row.expires_at - now).total_seconds()
+            _token_cache.set(token_hash, user, ttl=min(TOKEN_CACHE_TTL, remaining))
+            logger.debug(f"Token verificado para o usuário {user.username}.")
             return user
         else:
-            logger.debug(f"Token {token} não encontrado.")
+            logger.debug("Token não encontrado ou expirado.")
             return None
     except Exception as e:
         logger.exception(f"Erro ao verificar token: {e}")
         return None
-    finally:
-        session.close()
+
+def revoke_token(token):
+    """Invalidate a session token (logout)."""
+    if is_signed_token(token):
+        from data.signed_sessions import revoke_signed_token
+        return revoke_signed_token(token)
+
+    token_hash = hash_token(token)
+    _token_cache.pop(token_hash)
+    try:
+        with session_scope() as session:
+            deleted = session.query(UserSession).filter(
+                UserSession.token_hash == token_hash
+            ).delete(synchronize_session=False)
+            return deleted > 0
+    except Exception as e:
+        logger.exception(f"Erro ao revogar token: {e}")
+        return False
+
+def purge_expired_sessions(batch_size=SESSION_PURGE_BATCH_SIZE):
+    """Delete expired sessions in small batches to keep locks short."""
+    total = 0
+    while True:
+        try:
+            with session_scope() as session:
+                hashes = [h for (h,) in session.query(UserSession.token_hash)
+                          .filter(UserSession.expires_at <= datetime.utcnow())
+                          .limit(batch_size)
+                          .all()]
+                if hashes:
+                    session.query(UserSession)\
+                        .filter(UserSession.token_hash.in_(hashes))\
+                        .delete(synchronize_session=False)
+        except Exception as e:
+            logger.exception(f"Erro ao remover sessões expiradas: {e}")
+            break
+        total += len(hashes)
+        if len(hashes) < batch_size:
+            break
+    if total:
+        logger.info(f"{total} sessões expiradas removidas.")
+    return total
+
+def keyset_page(query, created_col, id_col, limit, cursor=None):
+    """Newest-first page of ``query`` keyed on (created_col, id_col).
+
+    Uses ``WHERE (created, id) < cursor ORDER BY created DESC, id DESC
+    LIMIT n+1`` instead of OFFSET, so every page is one index range scan.
+    Returns ``(rows, next_cursor)``; raises ValueError for a bad cursor.
+    """
+    if cursor:
+        before_at, before_id = decode_cursor(cursor, 2)
+        check_cursor_id(before_id, id_col)
+        if isinstance(created_col.type, DateTime):
+            before_at = parse_cursor_time(before_at)
+        query = query.filter(or_(
+            created_col < before_at,
+            and_(created_col == before_at, id_col < before_id)
+        ))
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
 
 
         #Functions for Logo, Image, Payment, and ChatMessage, and PostGenerator
 
 
+def isoformat(value):
+    """Serialize a timestamp column; tolerates legacy string values."""
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def encode_cursor(*values):
+    """Opaque pagination cursor for a keyset position."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+def parse_cursor_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def check_cursor_id(value, id_col):
+    """The id component of a cursor, if it has the column's type."""
+    if type(value) is not id_col.type.python_type:
+        raise ValueError("Invalid cursor")
+    return value
+
 def get_user_post(user_id,post_id):
-    session = SessionLocal()
     try:
-        post = session.query(PostGenerator).filter(
-            PostGenerator.user_id == user_id,
-            PostGenerator.post_id == post_id
-        ).first()
-        if post:
-            return {
-                'id': post.id,
-                'post_id': post.post_id,
-                'role': post.role,
-                'content': post.content,
-                'created_at': post.created_at
-            }
-        return None
+        with session_scope() as session:
+            post = session.query(PostGenerator).filter(
+                PostGenerator.user_id == user_id,
+                PostGenerator.post_id == post_id
+            ).first()
+            if post:
+                return {
+                    'id': post.id,
+                    'post_id': post.post_id,
+                    'role': post.role,
+                    'content': post.content,
+                    'created_at': post.created_at
+                }
+            return None
     except Exception as e:
         logger.exception(f"Error fetching user post: {e}")
         return None
-    finally:
-        session.close()
 
 def save_logo(user_id, company_name, sector, style, color, image_url):
-    session = SessionLocal()
     try:
-        logo = Logo(
-            user_id=user_id,
-            company_name=company_name,
-            sector=sector,
-            style=style,
-            color=color,
-            image_url=image_url
-        )
-        session.add(logo)
-        session.commit()
-        # Get all necessary data before closing the session
-        logo_data = {
-            'id': logo.id,
-            'image_url': logo.image_url,
-            'company_name': logo.company_name,
-            'created_at': logo.created_at
-        }
+        with session_scope() as session:
+            logo = Logo(
+                user_id=user_id,
+                company_name=company_name,
+                sector=sector,
+                style=style,
+                color=color,
+                image_url=image_url
+            )
+            session.add(logo)
+            session.flush()
+            logo_data = {
+                'id': logo.id,
+                'image_url': logo.image_url,
+                'company_name': logo.company_name,
+                'created_at': isoformat(logo.created_at)
+            }
         return logo_data
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error saving logo: {e}")
         return None
-    finally:
-        session.close()
 
-def get_user_logos(user_id):
-    session = SessionLocal()
+def get_user_logos(user_id, limit=50, cursor=None):
+    """Return ``(logos, next_cursor)``, newest first."""
     try:
-        logos = session.query(Logo).filter(Logo.user_id == user_id).all()
-        return logos
+        with read_session_scope() as session:
+            query = session.query(Logo).filter(Logo.user_id == user_id)
+            return keyset_page(query, Logo.created_at, Logo.id, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         logger.exception(f"Error fetching logos: {e}")
-        return []
-    finally:
-        session.close()
+        return [], None
 
 def delete_logo(logo_id, user_id):
-    session = SessionLocal()
     try:
-        logo = session.query(Logo).filter(Logo.id == logo_id, Logo.user_id == user_id).first()
-        if logo:
-            session.delete(logo)
-            session.commit()
-            return True
-        return False
+        with session_scope() as session:
+            logo = session.query(Logo).filter(Logo.id == logo_id, Logo.user_id == user_id).first()
+            if logo:
+                session.delete(logo)
+                return True
+            return False
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error deleting logo: {e}")
         return False
-    finally:
-        session.close()
 
 def save_image(user_id, prompt, style, image_url):
-    session = SessionLocal()
     try:
-        image = Image(
-            user_id=user_id,
-            prompt=prompt,
-            style=style,
-            image_url=image_url
-        )
-        session.add(image)
-        session.commit()
-        image_data = {
-            'id': image.id,
-            'image_url': image.image_url,
-            'prompt': image.prompt,
-            'created_at': image.created_at
-        }
+        with session_scope() as session:
+            image = Image(
+                user_id=user_id,
+                prompt=prompt,
+                style=style,
+                image_url=image_url
+            )
+            session.add(image)
+            session.flush()
+            image_data = {
+                'id': image.id,
+                'image_url': image.image_url,
+                'prompt': image.prompt,
+                'created_at': isoformat(image.created_at)
+            }
         return image_data
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error saving image: {e}")
         return None
-    finally:
-        session.close()
 
-def get_user_images(user_id):
-    session = SessionLocal()
+def get_user_images(user_id, limit=50, cursor=None):
+    """Return ``(images, next_cursor)``, newest first."""
     try:
-        images = session.query(Image).filter(Image.user_id == user_id).all()
-        return images
+        with read_session_scope() as session:
+            query = session.query(Image).filter(Image.user_id == user_id)
+            return keyset_page(query, Image.created_at, Image.id, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         logger.exception(f"Error fetching images: {e}")
-        return []
-    finally:
-        session.close()
+        return [], None
 
 def delete_image(image_id, user_id):
-    session = SessionLocal()
     try:
-        image = session.query(Image).filter(Image.id == image_id, Image.user_id == user_id).first()
-        if image:
-            session.delete(image)
-            session.commit()
-            return True
-        return False
+        with session_scope() as session:
+            image = session.query(Image).filter(Image.id == image_id, Image.user_id == user_id).first()
+            if image:
+                session.delete(image)
+                return True
+            return False
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error deleting image: {e}")
         return False
-    finally:
-        session.close()
 
 def create_payment(user_id, amount):
-    session = SessionLocal()
     try:
-        payment = Payment(
-            user_id=user_id,
-            amount=amount,
-            external_reference=str(uuid.uuid4())
-        )
-        session.add(payment)
-        session.commit()
-        return {
-            'id': payment.id,
-            'amount': payment.amount,
-            'status': payment.status,
-            'external_reference': payment.external_reference
-        }
+        with session_scope() as session:
+            payment = Payment(
+                user_id=user_id,
+                amount=amount,
+                external_reference=str(uuid.uuid4())
+            )
+            session.add(payment)
+            session.flush()
+            payment_data = {
+                'id': payment.id,
+                'amount': payment.amount,
+                'status': payment.status,
+                'external_reference': payment.external_reference
+            }
+        return payment_data
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error creating payment: {e}")
         return None
-    finally:
-        session.close()
 
 def update_payment_status(external_reference, status):
-    session = SessionLocal()
     try:
-        payment = session.query(Payment).filter(
-            Payment.external_reference == external_reference
-        ).first()
-        if payment:
-            payment.status = status
-            payment.updated_at = datetime.utcnow().isoformat()
-            session.commit()
-            return True
-        return False
+        with session_scope() as session:
+            payment = session.query(Payment).filter(
+                Payment.external_reference == external_reference
+            ).first()
+            if payment:
+                payment.status = status
+                payment.updated_at = datetime.utcnow()
+                return True
+            return False
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error updating payment status: {e}")
         return False
-    finally:
-        session.close()
 
 def get_user_payment_status(user_id):
-    session = SessionLocal()
     try:
-        payment = session.query(Payment).filter(
-            Payment.user_id == user_id,
-            Payment.status == 'approved'
-        ).first()
-        return payment is not None
+        with session_scope() as session:
+            payment = session.query(Payment).filter(
+                Payment.user_id == user_id,
+                Payment.status == 'approved'
+            ).first()
+            return payment is not None
     except Exception as e:
         logger.exception(f"Error checking payment status: {e}")
         return False
-    finally:
-        session.close()
 
 def get_payment_by_reference(external_reference):
-    session = SessionLocal()
     try:
-        payment = session.query(Payment).filter(
-            Payment.external_reference == external_reference
-        ).first()
-        if payment:
-            return {
-                'id': payment.id,
-                'user_id': payment.user_id,
-                'amount': payment.amount,
-                'status': payment.status,
-                'created_at': payment.created_at
-            }
-        return None
+        with read_session_scope() as session:
+            payment = session.query(Payment).filter(
+                Payment.external_reference == external_reference
+            ).first()
+            if payment:
+                return {
+                    'id': payment.id,
+                    'user_id': payment.user_id,
+                    'amount': payment.amount,
+                    'status': payment.status,
+                    'created_at': isoformat(payment.created_at)
+                }
+            return None
     except Exception as e:
         logger.exception(f"Error fetching payment: {e}")
         return None
-    finally:
-        session.close()
+
+def prepare_chat_message(user_id, role, content, **kwargs):
+    """Validate a chat message and return the row to insert."""
+    if not isinstance(user_id, int):
+        raise ValueError(f"Invalid user_id type: {type(user_id)}")
+    
+    if not content:
+        raise ValueError("Content cannot be empty")
+        
+    if role not in ['user', 'assistant']:
+        raise ValueError(f"Invalid role: {role}")
+
+    conversation_id = kwargs.get('conversation_id')
+    if not conversation_id:
+        conversation_id = str(uuid.uuid4())
+    elif not isinstance(conversation_id, str):
+        conversation_id = str(conversation_id)
+
+    logger.debug(f"Creating ChatMessage: user_id={user_id}, role={role}, conv_id={conversation_id}")
+
+    return {
+        'user_id': user_id,
+        'role': role,
+        'content': content,
+        'conversation_id': conversation_id,
+        'image_path': kwargs.get('image_path'),
+        'created_at': datetime.utcnow()
+    }
+
+def submit_chat_message(row):
+    """Hand the row to the write-behind queue; returns the message dict, or
+    None when write-behind is disabled or full and the caller must insert."""
+    from data.chat_writer import chat_writer
+    if chat_writer.enabled and chat_writer.submit(row):
+        # Persisted by the background flusher; no id yet
+        return {**row, 'id': None, 'created_at': isoformat(row['created_at'])}
+    return None
+
+def insert_chat_message(session, row):
+    """Insert the message and update its conversation in the same transaction."""
+    message = ChatMessage(**row)
+    session.add(message)
+    session.flush()  # Flush to get the ID without committing
+    logger.debug(f"Message flushed with ID: {message.id}")
+
+    # Same transaction as the message, so the summary never drifts
+    touch_conversation(session, row['user_id'], row['conversation_id'], row['role'], row['content'], row['created_at'])
+    return {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'role': message.role,
+        'content': message.content,
+        'image_path': message.image_path,
+        'created_at': isoformat(message.created_at)
+    }
 
 def save_chat_message(user_id, role, content, **kwargs):
-    session = SessionLocal()
     try:
-        if not isinstance(user_id, int):
-            raise ValueError(f"Invalid user_id type: {type(user_id)}")
-        
-        if not content:
-            raise ValueError("Content cannot be empty")
-            
-        if role not in ['user', 'assistant']:
-            raise ValueError(f"Invalid role: {role}")
-
-        conversation_id = kwargs.get('conversation_id')
-        if not conversation_id:
-            conversation_id = str(uuid.uuid4())
-        elif not isinstance(conversation_id, str):
-            conversation_id = str(conversation_id)
-
-        logger.debug(f"Creating ChatMessage: user_id={user_id}, role={role}, conv_id={conversation_id}")
-        
-        message = ChatMessage(
-            user_id=user_id,
-            role=role,
-            content=content,
-            conversation_id=conversation_id,
-            image_path=kwargs.get('image_path')
-        )
-        
-        session.add(message)
-        session.flush()  # Flush to get the ID without committing
-        logger.debug(f"Message flushed with ID: {message.id}")
-        
-        session.commit()
-        logger.info(f"Message committed successfully: id={message.id}")
+        row = prepare_chat_message(user_id, role, content, **kwargs)
 
-        return {
-            'id': message.id,
-            'conversation_id': message.conversation_id,
-            'role': message.role,
-            'content': message.content,
-            'image_path': message.image_path,
-            'created_at': message.created_at
-        }
+        if not kwargs.get('sync'):
+            queued = submit_chat_message(row)
+            if queued:
+                return queued
+
+        with session_scope() as session:
+            saved = insert_chat_message(session, row)
+
+        logger.info(f"Message saved successfully: id={saved['id']}")
+        return saved
         
     except Exception as e:
-        session.rollback()
         logger.exception(f"Error in save_chat_message: {str(e)}")
         raise
-    finally:
-        session.close()
+
+def touch_conversation(session, user_id, conversation_id, role, content, at, count=1, title=None):
+    """Create or update the conversations row for new message(s).
+
+    Uses a single INSERT ... ON CONFLICT DO UPDATE on PostgreSQL/SQLite so
+    concurrent writers increment message_count atomically. ``count`` lets
+    batched writers account for several messages at once; ``role`` and
+    ``content`` describe the latest of them and ``title`` may carry the
+    first user message of the batch.
+    """
+    preview = content[:CONVERSATION_PREVIEW_LENGTH]
+    if title is None and role == 'user':
+        title = content
+    title = title[:CONVERSATION_TITLE_LENGTH] if title else None
+    dialect = session.get_bind().dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert_fn = pg_insert if dialect == 'postgresql' else sqlite_insert
+        stmt = insert_fn(Conversation.__table__).values(
+            id=conversation_id,
+            user_id=user_id,
+            title=title,
+            created_at=at,
+            last_message_at=at,
+            message_count=count,
+            last_message_preview=preview
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Conversation.id],
+            set_={
+                'title': func.coalesce(Conversation.title, stmt.excluded.title),
+                'last_message_at': stmt.excluded.last_message_at,
+                'message_count': Conversation.message_count + stmt.excluded.message_count,
+                'last_message_preview': stmt.excluded.last_message_preview
+            },
+            # Never let one user bump another user's conversation
+            where=Conversation.user_id == stmt.excluded.user_id
+        )
+        session.execute(stmt)
+        return
+
+    conversation = session.query(Conversation).filter(Conversation.id == conversation_id).with_for_update().first()
+    if conversation is None:
+        session.add(Conversation(
+            id=conversation_id,
+            user_id=user_id,
+            title=title,
+            created_at=at,
+            last_message_at=at,
+            message_count=count,
+            last_message_preview=preview
+        ))
+    elif conversation.user_id == user_id:
+        conversation.title = conversation.title or title
+        conversation.last_message_at = at
+        conversation.message_count += count
+        conversation.last_message_preview = preview
+
+def backfill_conversations(batch_size=500):
+    """Build conversations rows for chat messages saved before the table existed."""
+    total = 0
+    while True:
+        with session_scope() as session:
+            missing = session.query(
+                ChatMessage.conversation_id,
+                func.min(ChatMessage.user_id).label('user_id'),
+                func.min(ChatMessage.created_at).label('first_at'),
+                func.max(ChatMessage.created_at).label('last_at'),
+                func.count(ChatMessage.id).label('message_count')
+            )\
+                .outerjoin(Conversation, Conversation.id == ChatMessage.conversation_id)\
+                .filter(Conversation.id.is_(None))\
+                .group_by(ChatMessage.conversation_id)\
+                .limit(batch_size)\
+                .all()
+            if not missing:
+                break
+
+            conv_ids = [row.conversation_id for row in missing]
+            first_user, last_message = {}, {}
+            for msg in session.query(ChatMessage.conversation_id, ChatMessage.role, ChatMessage.content)\
+                    .filter(ChatMessage.conversation_id.in_(conv_ids))\
+                    .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()):
+                if msg.role == 'user':
+                    first_user.setdefault(msg.conversation_id, msg.content)
+                last_message[msg.conversation_id] = msg.content
+
+            session.add_all([Conversation(
+                id=row.conversation_id,
+                user_id=row.user_id,
+                title=(first_user.get(row.conversation_id) or '')[:CONVERSATION_TITLE_LENGTH] or None,
+                created_at=row.first_at,
+                last_message_at=row.last_at,
+                message_count=row.message_count,
+                last_message_preview=last_message.get(row.conversation_id, '')[:CONVERSATION_PREVIEW_LENGTH]
+            ) for row in missing])
+        total += len(missing)
+        logger.info(f"{total} conversas reconstruídas até agora.")
+        if len(missing) < batch_size:
+            break
+    return total
+
+def _serialize_chat_message(msg):
+    return {
+        'id': msg.id,
+        'role': msg.role,
+        'content': msg.content,
+        'image_path': msg.image_path,
+        'created_at': isoformat(msg.created_at)
+    }
 
 def get_chat_history(user_id):
-    session = SessionLocal()
     try:
-        # Get unique conversation IDs
-        conversations = session.query(ChatMessage.conversation_id)\
-            .filter(ChatMessage.user_id == user_id)\
-            .distinct()\
-            .all()
-
-        history = []
-        for (conv_id,) in conversations:
+        with read_session_scope() as session:
+            # One ordered query, grouped in Python (conversations keep the
+            # order of their first message)
             messages = session.query(ChatMessage)\
-                .filter(
-                    ChatMessage.user_id == user_id,
-                    ChatMessage.conversation_id == conv_id
-                )\
-                .order_by(ChatMessage.created_at.asc())\
+                .filter(ChatMessage.user_id == user_id)\
+                .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())\
                 .all()
-            if messages:
-                history.append({
-                    'id': conv_id,
-                    'messages': [{
-                        'role': msg.role,
-                        'content': msg.content,
-                        'image_path': msg.image_path,
-                        'created_at': msg.created_at
-                    } for msg in messages]
-                })
-        return history
+
+        conversations = {}
+        for msg in messages:
+            conversations.setdefault(msg.conversation_id, []).append(_serialize_chat_message(msg))
+        return [{'id': conv_id, 'messages': msgs} for conv_id, msgs in conversations.items()]
     except Exception as e:
         logger.exception(f"Error fetching chat history: {e}")
         return []
-    finally:
-        session.close()
 
-def get_posts_history(user_id):
-    """Get all posts for a user"""
-    session = SessionLocal()
+def list_conversations(user_id, limit=20, cursor=None):
+    """Page through a user's conversations, most recently active first.
+
+    Served from the denormalized conversations table with one index range
+    scan on (user_id, last_message_at DESC, id DESC). Returns
+    ``(conversations, next_cursor)``; ``next_cursor`` is None on the last
+    page. Raises ValueError for a malformed cursor.
+    """
+    after = decode_cursor(cursor, 2) if cursor else None
+    with read_session_scope() as session:
+        query = session.query(Conversation).filter(Conversation.user_id == user_id)
+        if after:
+            after_at = parse_cursor_time(after[0])
+            after_id = check_cursor_id(after[1], Conversation.id)
+            query = query.filter(or_(
+                Conversation.last_message_at < after_at,
+                and_(Conversation.last_message_at == after_at, Conversation.id < after_id)
+            ))
+        rows = query.order_by(Conversation.last_message_at.desc(), Conversation.id.desc())\
+            .limit(limit + 1)\
+            .all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].last_message_at, rows[-1].id)
+    conversations = [{
+        'id': conv.id,
+        'title': conv.title,
+        'last_message_at': conv.last_message_at.isoformat(),
+        'message_count': conv.message_count,
+        'last_message_preview': conv.last_message_preview
+    } for conv in rows]
+    return conversations, next_cursor
+
+def get_conversation_messages(user_id, conversation_id, limit=50, cursor=None):
+    """Page backwards through one conversation using (created_at, id) keysets.
+
+    Each page is returned in chronological order; ``next_cursor`` points at
+    the page of older messages. Raises ValueError for a malformed cursor.
+    """
+    with read_session_scope() as session:
+        query = session.query(ChatMessage).filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.conversation_id == conversation_id
+        )
+        messages, next_cursor = keyset_page(query, ChatMessage.created_at, ChatMessage.id, limit, cursor)
+    return [_serialize_chat_message(msg) for msg in reversed(messages)], next_cursor
+
+def get_conversation_context(user_id, conversation_id, limit=100):
+    """Summary state plus the newest ``limit`` messages not yet summarized.
+
+    Returns ``(summary, summary_until_id, messages)`` with messages newest
+    first. Reads the primary so the previous turn is always visible.
+    """
+    with session_scope() as session:
+        conversation = session.query(
+            Conversation.summary, Conversation.summary_until_id
+        ).filter(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        ).first()
+        summary, until_id = conversation if conversation else (None, None)
+
+        query = session.query(ChatMessage).filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.conversation_id == conversation_id
+        )
+        if until_id is not None:
+            query = query.filter(ChatMessage.id > until_id)
+        messages = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit).all()
+    return summary, until_id, [_serialize_chat_message(msg) for msg in messages]
+
+def get_messages_to_summarize(user_id, conversation_id, after_id, until_id):
+    """Messages in (after_id, until_id], oldest first."""
+    with session_scope() as session:
+        query = session.query(ChatMessage).filter(
+            ChatMessage.user_id == user_id,
+            ChatMessage.conversation_id == conversation_id,
+            ChatMessage.id <= until_id
+        )
+        if after_id is not None:
+            query = query.filter(ChatMessage.id > after_id)
+        messages = query.order_by(ChatMessage.created_at, ChatMessage.id).all()
+    return [_serialize_chat_message(msg) for msg in messages]
+
+def save_conversation_summary(user_id, conversation_id, summary, until_id):
+    """Store a newer rolling summary; ignored if one covering more exists."""
+    with session_scope() as session:
+        updated = session.query(Conversation).filter(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id,
+            or_(Conversation.summary_until_id.is_(None), Conversation.summary_until_id < until_id)
+        ).update({
+            'summary': summary,
+            'summary_until_id': until_id,
+            'summary_updated_at': datetime.utcnow()
+        }, synchronize_session=False)
+    return updated > 0
+
+def get_posts_history(user_id, limit=20, cursor=None):
+    """Get a page of posts for a user: ``(posts, next_cursor)``, newest first"""
     try:
-        posts = session.query(Post).filter(Post.user_id == user_id).order_by(Post.created_at.desc()).all()
-        # Always return a list (empty if none)
-        return posts if posts else []
+        with read_session_scope() as session:
+            query = session.query(Post).filter(Post.user_id == user_id)
+            return keyset_page(query, Post.created_at, Post.id, limit, cursor)
+    except ValueError:
+        raise
     except Exception as e:
         logger.error(f"Error getting posts history: {e}")
-        return []
-    finally:
-        session.close()
+        return [], None
 
 def create_post(user_id, topic, content, format, tone, word_count):
     """Create a new post"""
-    session = SessionLocal()
     try:
         # Defensive: ensure word_count is int
         try:
             word_count = int(word_count)
         except Exception:
             word_count = 0
-        post = Post(
-            user_id=user_id,
-            topic=topic,
-            content=content,
-            format=format,
-            tone=tone,
-            word_count=word_count
-        )
-        session.add(post)
-        session.commit()
+        with session_scope() as session:
+            post = Post(
+                user_id=user_id,
+                topic=topic,
+                content=content,
+                format=format,
+                tone=tone,
+                word_count=word_count
+            )
+            session.add(post)
+            session.flush()
         logger.info(f"Post created successfully: {post.id}")
         return post
     except Exception as e:
-        session.rollback()
         logger.error(f"Error creating post: {e}")
         return None
-    finally:
-        session.close()
 
 def update_post(post_id, user_id, topic, content):
     """Update an existing post"""
-    session = SessionLocal()
     try:
-        post = session.query(Post).filter(Post.id == post_id, Post.user_id == user_id).first()
-        if post:
-            post.topic = topic
-            post.content = content
-            session.commit()
-            logger.info(f"Post updated successfully: {post_id}")
-            return True
-        logger.warning(f"Post not found: {post_id}")
-        return False
+        with session_scope() as session:
+            post = session.query(Post).filter(Post.id == post_id, Post.user_id == user_id).first()
+            if post:
+                post.topic = topic
+                post.content = content
+                logger.info(f"Post updated successfully: {post_id}")
+                return True
+            logger.warning(f"Post not found: {post_id}")
+            return False
     except Exception as e:
-        session.rollback()
         logger.error(f"Error updating post: {e}")
         return False
-    finally:
-        session.close()
 
 def delete_post(post_id, user_id):
     """Delete a post"""
-    session = SessionLocal()
     try:
-        post = session.query(Post).filter(Post.id == post_id, Post.user_id == user_id).first()
-        if post:
-            session.delete(post)
-            session.commit()
-            logger.info(f"Post deleted successfully: {post_id}")
-            return True
-        logger.warning(f"Post not found: {post_id}")
-        return False
+        with session_scope() as session:
+            post = session.query(Post).filter(Post.id == post_id, Post.user_id == user_id).first()
+            if post:
+                session.delete(post)
+                logger.info(f"Post deleted successfully: {post_id}")
+                return True
+            logger.warning(f"Post not found: {post_id}")
+            return False
     except Exception as e:
-        session.rollback()
         logger.error(f"Error deleting post: {e}")
         return False
-    finally:
-        session.close()
 
-init_db()
\ No newline at end of file
+def purge_expired_revocations(batch_size=SESSION_PURGE_BATCH_SIZE):
+    """Delete signed-session revocations whose tokens have expired anyway."""
+    total = 0
+    while True:
+        try:
+            with session_scope() as session:
+                ids = [i for (i,) in session.query(SessionRevocation.id)
+                       .filter(SessionRevocation.expires_at <= datetime.utcnow())
+                       .limit(batch_size)
+                       .all()]
+                if ids:
+                    session.query(SessionRevocation)\
+                        .filter(SessionRevocation.id.in_(ids))\
+                        .delete(synchronize_session=False)
+        except Exception as e:
+            logger.exception(f"Erro ao remover revogações expiradas: {e}")
+            break
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
+
+#Functions for the shared LLM response cache
+def get_llm_cache_entry(key):
+    """Cached JSON value for ``key`` or None if missing/expired."""
+    try:
+        with session_scope() as session:
+            row = session.query(LLMCacheEntry.value).filter(
+                LLMCacheEntry.key == key,
+                LLMCacheEntry.expires_at > datetime.utcnow()
+            ).first()
+            return json.loads(row[0]) if row else None
+    except Exception as e:
+        logger.exception(f"Error reading LLM cache: {e}")
+        return None
+
+def set_llm_cache_entry(key, value, ttl):
+    try:
+        now = datetime.utcnow()
+        values = {
+            'key': key,
+            'value': json.dumps(value),
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=ttl)
+        }
+        with session_scope() as session:
+            dialect = session.get_bind().dialect.name
+            if dialect in ('postgresql', 'sqlite'):
+                insert_fn = pg_insert if dialect == 'postgresql' else sqlite_insert
+                stmt = insert_fn(LLMCacheEntry.__table__).values(**values)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[LLMCacheEntry.key],
+                    set_={name: stmt.excluded[name] for name in ('value', 'created_at', 'expires_at')}
+                )
+                session.execute(stmt)
+            else:
+                session.merge(LLMCacheEntry(**values))
+        return True
+    except Exception as e:
+        logger.exception(f"Error writing LLM cache: {e}")
+        return False
+
+def purge_expired_llm_cache(batch_size=SESSION_PURGE_BATCH_SIZE):
+    """Delete expired shared cache entries in small batches."""
+    total = 0
+    while True:
+        try:
+            with session_scope() as session:
+                keys = [k for (k,) in session.query(LLMCacheEntry.key)
+                        .filter(LLMCacheEntry.expires_at <= datetime.utcnow())
+                        .limit(batch_size)
+                        .all()]
+                if keys:
+                    session.query(LLMCacheEntry)\
+                        .filter(LLMCacheEntry.key.in_(keys))\
+                        .delete(synchronize_session=False)
+        except Exception as e:
+            logger.exception(f"Erro ao remover entradas expiradas do cache: {e}")
+            break
+        total += len(keys)
+        if len(keys) < batch_size:
+            break
+    return total
@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from data.db import ChatMessage, Post, SessionLocal, _open_replica_session, isoformat, replicas
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Exportação do histórico completo (chat + posts) como NDJSON, gerada
+# enquanto é enviada: as linhas vêm de um cursor do lado do servidor
+# (yield_per / stream_results) em lotes de EXPORT_BATCH_SIZE, então a memória
+# fica constante qualquer que seja o tamanho do histórico.
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', str(64 * 1024)))
+EXPORT_GZIP_LEVEL = int(os.getenv('EXPORT_GZIP_LEVEL', '6'))
+EXPORT_VERSION = 1
+
+SECTIONS = ('chat_messages', 'posts')
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+_stats = {'exports': 0, 'failures': 0, 'records': 0, 'bytes': 0}
+metrics.register('export', lambda: dict(_stats))
+
+
+def _export_session():
+    """A session of its own, held for the whole export (one snapshot).
+
+    Uses a read replica when configured: exports tolerate replication lag
+    and can be long-running.
+    """
+    session = _open_replica_session() if replicas else None
+    return session or SessionLocal()
+
+
+def _chat_message_records(session, user_id):
+    table = ChatMessage.__table__
+    # Ordem do índice (user_id, conversation_id, created_at, id): sem sort
+    query = select(
+        table.c.id, table.c.conversation_id, table.c.role, table.c.content,
+        table.c.image_path, table.c.created_at
+    ).where(table.c.user_id == user_id).order_by(
+        table.c.conversation_id, table.c.created_at, table.c.id
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    for id_, conversation_id, role, content, image_path, created_at in session.execute(query):
+        yield {
+            'type': 'chat_message',
+            'id': id_,
+            'conversation_id': conversation_id,
+            'role': role,
+            'content': content,
+            'image_path': image_path,
+            'created_at': isoformat(created_at)
+        }
+
+
+def _post_records(session, user_id):
+    table = Post.__table__
+    query = select(
+        table.c.id, table.c.topic, table.c.content, table.c.format,
+        table.c.tone, table.c.word_count, table.c.created_at
+    ).where(table.c.user_id == user_id).order_by(
+        table.c.created_at.desc(), table.c.id.desc()
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    for id_, topic, content, format_, tone, word_count, created_at in session.execute(query):
+        yield {
+            'type': 'post',
+            'id': id_,
+            'topic': topic,
+            'content': content,
+            'format': format_,
+            'tone': tone,
+            'word_count': word_count,
+            'created_at': isoformat(created_at)
+        }
+
+
+_SECTION_RECORDS = {
+    'chat_messages': _chat_message_records,
+    'posts': _post_records,
+}
+
+
+def iter_export_records(user_id, sections=SECTIONS):
+    """Header, every record of ``sections`` and a trailer with the count.
+
+    A missing ``end`` record means the export was cut short.
+    """
+    yield {
+        'type': 'export',
+        'version': EXPORT_VERSION,
+        'user_id': user_id,
+        'sections': list(sections),
+        'generated_at': datetime.utcnow().isoformat()
+    }
+    count = 0
+    session = _export_session()
+    try:
+        for section in sections:
+            for record in _SECTION_RECORDS[section](session, user_id):
+                count += 1
+                yield record
+    finally:
+        _stats['records'] += count
+        session.close()
+    yield {'type': 'end', 'records': count}
+
+
+def ndjson_chunks(records, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Encode records as NDJSON, yielding ~``chunk_bytes`` byte strings."""
+    buffer = []
+    size = 0
+    for record in records:
+        line = _encoder.encode(record).encode('utf-8') + b'\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks, level=EXPORT_GZIP_LEVEL):
+    """Gzip a byte stream on the fly (a complete .gz file, not per-chunk members)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(user_id, sections=SECTIONS, compress=False):
+    """Bytes of the NDJSON export (gzipped if ``compress``), counted in metrics."""
+    _stats['exports'] += 1
+    chunks = ndjson_chunks(iter_export_records(user_id, sections))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    try:
+        for chunk in chunks:
+            _stats['bytes'] += len(chunk)
+            yield chunk
+    except Exception as e:
+        _stats['failures'] += 1
+        logger.exception(f"Export for user {user_id} failed: {e}")
+        raise
+    finally:
+        chunks.close()
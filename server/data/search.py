@@ -0,0 +1,229 @@
+import html
+import logging
+import os
+from sqlalchemy import DateTime, inspect, text
+from data.db import decode_cursor, encode_cursor, get_engine, isoformat, read_session_scope
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Busca textual em mensagens do chat e posts salvos. No Postgres usa
+# to_tsvector/websearch_to_tsquery com índices GIN de expressão (mantidos pelo
+# próprio banco a cada INSERT/UPDATE); no SQLite, tabelas FTS5 de conteúdo
+# externo atualizadas por triggers. Ambos criados pela migração 0008
+# (init_db cria os que faltarem).
+#
+# SEARCH_TEXT_CONFIG faz parte da expressão indexada: mudar o valor exige
+# recriar os índices, senão as consultas deixam de usá-los.
+SEARCH_TEXT_CONFIG = os.getenv('SEARCH_TEXT_CONFIG', 'portuguese')
+SEARCH_MAX_QUERY_LENGTH = int(os.getenv('SEARCH_MAX_QUERY_LENGTH', '200'))
+SEARCH_MAX_OFFSET = int(os.getenv('SEARCH_MAX_OFFSET', '1000'))
+SNIPPET_WORDS = 12
+
+# Expressões indexadas; as consultas precisam repeti-las exatamente
+MESSAGE_VECTOR = f"to_tsvector('{SEARCH_TEXT_CONFIG}', content)"
+POST_VECTOR = f"to_tsvector('{SEARCH_TEXT_CONFIG}', coalesce(topic, '') || ' ' || content)"
+
+# Objetos da busca, criados pela migração 0008 (ou por init_db):
+# índices GIN de expressão no Postgres...
+SEARCH_INDEXES = {
+    'ix_chat_messages_fts': ('chat_messages', MESSAGE_VECTOR),
+    'ix_posts_fts': ('posts', POST_VECTOR),
+}
+# ...e no SQLite tabelas FTS5 de conteúdo externo (sem cópia do texto)
+FTS_TABLES = {
+    'chat_messages_fts': ('chat_messages', ['content']),
+    'posts_fts': ('posts', ['topic', 'content']),
+}
+
+# Marcadores de destaque trocados por <mark> depois de escapar o texto
+_START, _STOP = '\x02', '\x03'
+
+_stats = {'queries': 0, 'failures': 0}
+metrics.register('search', lambda: dict(_stats))
+
+
+def sqlite_fts_statements(fts_table, table, columns):
+    """DDL of an FTS5 table over ``table``, kept in sync by triggers and filled once with 'rebuild'."""
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f"new.{c}" for c in columns)
+    old_values = ', '.join(f"old.{c}" for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{column_list}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {table} BEGIN "
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",
+    ]
+
+
+def create_search_schema(connection):
+    """Create the search indexes / FTS tables that are missing (for init_db)."""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        for name, (table, vector) in SEARCH_INDEXES.items():
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({vector})"))
+    elif dialect == 'sqlite':
+        inspector = inspect(connection)
+        for fts_table, (table, columns) in FTS_TABLES.items():
+            if inspector.has_table(fts_table):
+                continue
+            for sql in sqlite_fts_statements(fts_table, table, columns):
+                connection.execute(text(sql))
+
+
+def _is_postgres():
+    return get_engine().dialect.name == 'postgresql'
+
+
+def fts5_query(query):
+    """Quote each term so FTS5 syntax in user input is matched literally (AND)."""
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn the match markers into <mark> tags."""
+    if not snippet:
+        return snippet
+    return html.escape(snippet).replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def _page(cursor):
+    offset = decode_cursor(cursor, 1)[0] if cursor else 0
+    if not isinstance(offset, int) or offset < 0 or offset > SEARCH_MAX_OFFSET:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+def _finish(rows, limit, offset):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if offset + limit <= SEARCH_MAX_OFFSET:
+            next_cursor = encode_cursor(offset + limit)
+    return rows, next_cursor
+
+
+def _message_sql(postgres):
+    if postgres:
+        # Ranking pelo índice primeiro; ts_headline (caro) só para a página
+        return f"""
+            SELECT m.id, m.conversation_id, m.role, m.created_at, hits.rank,
+                   ts_headline('{SEARCH_TEXT_CONFIG}', m.content, websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query),
+                               'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords={SNIPPET_WORDS * 2}, MinWords={SNIPPET_WORDS // 2}') AS snippet
+            FROM (
+                SELECT id, ts_rank_cd({MESSAGE_VECTOR}, q) AS rank
+                FROM chat_messages, websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query) q
+                WHERE user_id = :user_id AND {MESSAGE_VECTOR} @@ q
+                ORDER BY rank DESC, id DESC
+                LIMIT :limit OFFSET :offset
+            ) hits
+            JOIN chat_messages m ON m.id = hits.id
+            ORDER BY hits.rank DESC, m.id DESC
+        """
+    return f"""
+        SELECT m.id, m.conversation_id, m.role, m.created_at, -bm25(chat_messages_fts) AS rank,
+               snippet(chat_messages_fts, 0, char(2), char(3), '…', {SNIPPET_WORDS}) AS snippet
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        WHERE chat_messages_fts MATCH :query AND m.user_id = :user_id
+        ORDER BY bm25(chat_messages_fts), m.id DESC
+        LIMIT :limit OFFSET :offset
+    """
+
+
+def _post_sql(postgres):
+    if postgres:
+        return f"""
+            SELECT p.id, p.topic, p.format, p.tone, p.created_at, hits.rank,
+                   ts_headline('{SEARCH_TEXT_CONFIG}', p.content, websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query),
+                               'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords={SNIPPET_WORDS * 2}, MinWords={SNIPPET_WORDS // 2}') AS snippet
+            FROM (
+                SELECT id, ts_rank_cd({POST_VECTOR}, q) AS rank
+                FROM posts, websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query) q
+                WHERE user_id = :user_id AND {POST_VECTOR} @@ q
+                ORDER BY rank DESC, id DESC
+                LIMIT :limit OFFSET :offset
+            ) hits
+            JOIN posts p ON p.id = hits.id
+            ORDER BY hits.rank DESC, p.id DESC
+        """
+    # Tópico pesa mais que o corpo no bm25
+    return f"""
+        SELECT p.id, p.topic, p.format, p.tone, p.created_at, -bm25(posts_fts, 2.0, 1.0) AS rank,
+               snippet(posts_fts, 1, char(2), char(3), '…', {SNIPPET_WORDS}) AS snippet
+        FROM posts_fts
+        JOIN posts p ON p.id = posts_fts.rowid
+        WHERE posts_fts MATCH :query AND p.user_id = :user_id
+        ORDER BY bm25(posts_fts, 2.0, 1.0), p.id DESC
+        LIMIT :limit OFFSET :offset
+    """
+
+
+def _search(sql_for, serialize, user_id, query, limit, cursor):
+    query = (query or '').strip()
+    if not query:
+        raise ValueError("Missing search query")
+    if len(query) > SEARCH_MAX_QUERY_LENGTH:
+        raise ValueError(f"Search query longer than {SEARCH_MAX_QUERY_LENGTH} characters")
+    offset = _page(cursor)
+    postgres = _is_postgres()
+    params = {
+        'user_id': user_id,
+        'query': query if postgres else fts5_query(query),
+        'limit': limit + 1,
+        'offset': offset
+    }
+    _stats['queries'] += 1
+    try:
+        with read_session_scope() as session:
+            # Tipado: no SQLite o created_at cru viria como texto ('YYYY-MM-DD HH:MM:SS')
+            statement = text(sql_for(postgres)).columns(created_at=DateTime)
+            rows = session.execute(statement, params).mappings().all()
+    except Exception:
+        _stats['failures'] += 1
+        raise
+    rows, next_cursor = _finish(rows, limit, offset)
+    return [serialize(row) for row in rows], next_cursor
+
+
+def _serialize_message_hit(row):
+    return {
+        'id': row['id'],
+        'conversation_id': row['conversation_id'],
+        'role': row['role'],
+        'created_at': isoformat(row['created_at']),
+        'rank': round(float(row['rank']), 4),
+        'snippet': highlight(row['snippet'])
+    }
+
+
+def _serialize_post_hit(row):
+    return {
+        'id': row['id'],
+        'topic': row['topic'],
+        'format': row['format'],
+        'tone': row['tone'],
+        'created_at': isoformat(row['created_at']),
+        'rank': round(float(row['rank']), 4),
+        'snippet': highlight(row['snippet'])
+    }
+
+
+def search_chat_messages(user_id, query, limit=20, cursor=None):
+    """Ranked chat message hits with highlighted snippets: ``(hits, next_cursor)``.
+
+    Best match first. Raises ValueError for an empty/too long query or a bad
+    cursor; the cursor stops at SEARCH_MAX_OFFSET results.
+    """
+    return _search(_message_sql, _serialize_message_hit, user_id, query, limit, cursor)
+
+
+def search_posts(user_id, query, limit=20, cursor=None):
+    """Ranked saved post hits (topic and content), like search_chat_messages."""
+    return _search(_post_sql, _serialize_post_hit, user_id, query, limit, cursor)
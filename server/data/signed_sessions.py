@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+import jwt
+from data.db import SessionLocal, SessionRevocation, SessionUser, SESSION_MAX_AGE
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# 'database' (padrão): token opaco validado na tabela user_sessions.
+# 'signed': JWT assinado com SECRET_KEY, validado sem acessar o banco.
+SESSION_TOKEN_MODE = os.getenv('SESSION_TOKEN_MODE', 'database')
+# JWTs só são aceitos no modo 'signed'. Ao voltar para 'database', os tokens
+# assinados ainda válidos deixam de valer na hora, a menos que
+# SESSION_ACCEPT_SIGNED_TOKENS=1 os mantenha durante a transição.
+SESSION_ACCEPT_SIGNED_TOKENS = SESSION_TOKEN_MODE == 'signed' or os.getenv('SESSION_ACCEPT_SIGNED_TOKENS', '0') == '1'
+SESSION_REVOCATION_REFRESH = int(os.getenv('SESSION_REVOCATION_REFRESH', '30'))
+SIGNING_ALGORITHM = 'HS256'
+# Intervalo entre novas tentativas enquanto a primeira carga não deu certo
+REVOCATION_RETRY_SECONDS = 5
+
+
+def _secret_key():
+    secret = os.getenv('SECRET_KEY')
+    if not secret:
+        raise ValueError("SECRET_KEY is required for signed sessions")
+    return secret
+
+
+class RevocationSet:
+    """In-memory copy of session_revocations, refreshed in the background.
+
+    Verification only reads the local sets; the database is queried once at
+    first use and then every ``refresh_interval`` seconds by a daemon thread.
+    Until the first load succeeds every signed token counts as revoked (fail
+    closed), with a reload attempted at most every REVOCATION_RETRY_SECONDS.
+    """
+
+    def __init__(self, refresh_interval=SESSION_REVOCATION_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._jtis = set()
+        self._lock = threading.Lock()
+        self._started = False
+        self._next_retry = 0
+        self.loaded = False
+        self.last_refresh = None
+        self.refresh_errors = 0
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.refresh()
+        thread = threading.Thread(target=self._run, name='session-revocations', daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+    def refresh(self):
+        session = None
+        try:
+            session = SessionLocal()
+            rows = session.query(SessionRevocation.jti).filter(
+                SessionRevocation.jti.isnot(None),
+                SessionRevocation.expires_at > datetime.utcnow()
+            ).all()
+            jtis = {jti for jti, in rows}
+            with self._lock:
+                self._jtis = jtis
+            self.last_refresh = time.time()
+            self.loaded = True
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.exception(f"Erro ao atualizar revogações de sessão: {e}")
+        finally:
+            if session is not None:
+                session.close()
+
+    def add_jti(self, jti):
+        with self._lock:
+            self._jtis.add(jti)
+
+    def _retry_load(self):
+        with self._lock:
+            if self.loaded or time.time() < self._next_retry:
+                return
+            self._next_retry = time.time() + REVOCATION_RETRY_SECONDS
+        self.refresh()
+
+    def is_revoked(self, jti):
+        self._ensure_started()
+        if not self.loaded:
+            self._retry_load()
+            if not self.loaded:
+                return True
+        return jti in self._jtis
+
+    def stats(self):
+        return {
+            'mode': SESSION_TOKEN_MODE,
+            'accept_signed_tokens': SESSION_ACCEPT_SIGNED_TOKENS,
+            'loaded': self.loaded,
+            'revoked_tokens': len(self._jtis),
+            'last_refresh': self.last_refresh,
+            'refresh_errors': self.refresh_errors
+        }
+
+
+_revocations = RevocationSet()
+metrics.register('signed_sessions', _revocations.stats)
+
+
+def issue_signed_token(user_id, username, max_age=SESSION_MAX_AGE):
+    now = time.time()
+    payload = {
+        'sub': str(user_id),
+        'name': username,
+        'iat': now,
+        'exp': int(now + max_age),
+        'jti': uuid.uuid4().hex
+    }
+    return jwt.encode(payload, _secret_key(), algorithm=SIGNING_ALGORITHM)
+
+
+def _decode(token, verify_exp=True):
+    return jwt.decode(
+        token,
+        _secret_key(),
+        algorithms=[SIGNING_ALGORITHM],
+        options={'verify_exp': verify_exp, 'require': ['sub', 'exp', 'iat', 'jti']}
+    )
+
+
+def verify_signed_token(token):
+    if not SESSION_ACCEPT_SIGNED_TOKENS:
+        logger.debug("Token assinado recusado: SESSION_TOKEN_MODE não é 'signed'.")
+        return None
+    try:
+        payload = _decode(token)
+        user_id = int(payload['sub'])
+        if _revocations.is_revoked(payload['jti']):
+            logger.debug("Token assinado revogado.")
+            return None
+        return SessionUser(id=user_id, username=payload.get('name'))
+    except jwt.InvalidTokenError as e:
+        logger.debug(f"Token assinado inválido: {e}")
+        return None
+    except Exception as e:
+        logger.exception(f"Erro ao verificar token assinado: {e}")
+        return None
+
+
+def _save_revocation(revocation):
+    session = SessionLocal()
+    try:
+        session.add(revocation)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        logger.exception(f"Erro ao salvar revogação de sessão: {e}")
+        return False
+    finally:
+        session.close()
+
+
+def revoke_signed_token(token):
+    """Revoke one signed token until it would have expired anyway (logout)."""
+    try:
+        payload = _decode(token, verify_exp=False)
+    except jwt.InvalidTokenError:
+        return False
+    expires_at = datetime.utcfromtimestamp(payload['exp'])
+    if expires_at <= datetime.utcnow():
+        return True
+    _revocations.add_jti(payload['jti'])
+    return _save_revocation(SessionRevocation(
+        jti=payload['jti'],
+        user_id=int(payload['sub']),
+        expires_at=expires_at
+    ))
+
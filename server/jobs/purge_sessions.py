@@ -0,0 +1,28 @@
+import sys
+import os
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.db import purge_expired_sessions, purge_expired_revocations, purge_expired_llm_cache, SESSION_PURGE_BATCH_SIZE
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove expired rows from user_sessions, session_revocations and llm_cache.")
+    parser.add_argument('--batch-size', type=int, default=SESSION_PURGE_BATCH_SIZE)
+    parser.add_argument('--interval', type=int, default=0,
+                        help="Run forever, sleeping this many seconds between purges (0 = run once).")
+    args = parser.parse_args()
+
+    while True:
+        removed = purge_expired_sessions(batch_size=args.batch_size)
+        print(f"Purged {removed} expired sessions")
+        removed = purge_expired_revocations(batch_size=args.batch_size)
+        print(f"Purged {removed} expired session revocations")
+        removed = purge_expired_llm_cache(batch_size=args.batch_size)
+        print(f"Purged {removed} expired LLM cache entries")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
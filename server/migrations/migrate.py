@@ -1,19 +1,35 @@
 import sys
 import os
+import argparse
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from data.db import engine, Base, ChatMessage
-from sqlalchemy import text
+from data.db import get_engine
+from migrations.runner import run_migrations, pending_migrations, applied_versions, discover_migrations
 
 def migrate():
-    # Drop the chat_messages table if it exists
-    with engine.connect() as conn:
-        conn.execute(text("DROP TABLE IF EXISTS chat_messages CASCADE"))
-        conn.commit()
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument('--dry-run', action='store_true', help="Print the SQL instead of executing it.")
+    parser.add_argument('--list', action='store_true', help="Show applied and pending migrations.")
+    parser.add_argument('--target', help="Stop after this version (e.g. 0003).")
+    args = parser.parse_args()
+    engine = get_engine()
 
-    # Recreate tables
-    Base.metadata.create_all(bind=engine, tables=[ChatMessage.__table__])
-    print("Migration completed successfully")
+    if args.list:
+        applied = applied_versions(engine)
+        for migration in discover_migrations():
+            status = 'applied' if migration.version in applied else 'pending'
+            print(f"{migration.version}  {status:<8} {migration.description}")
+        return
+
+    if not pending_migrations(engine, args.target):
+        print("Database is up to date")
+        return
+
+    versions = run_migrations(engine, dry_run=args.dry_run, target=args.target)
+    if args.dry_run:
+        print(f"-- dry run: {len(versions)} migration(s) not applied")
+    else:
+        print(f"Migration completed successfully: {', '.join(versions)}")
 
 if __name__ == "__main__":
     migrate()
@@ -0,0 +1,190 @@
+"""Versioned, non-destructive schema migrations.
+
+Each file in ``migrations/versions`` named ``<version>_<name>.py`` defines:
+
+    DESCRIPTION = "..."
+    TRANSACTIONAL = True   # False for CREATE INDEX CONCURRENTLY / batched backfills
+
+    def upgrade(ctx):
+        ctx.execute("ALTER TABLE ...")
+
+Applied versions are recorded in the ``schema_migrations`` table. With
+``dry_run=True`` nothing is executed and the SQL is printed instead.
+"""
+import glob
+import importlib.util
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'versions')
+DEFAULT_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '5000'))
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            spec = importlib.util.spec_from_file_location(f"migration_{self.version}", self.path)
+            self._module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self._module)
+        return self._module
+
+    @property
+    def description(self):
+        return getattr(self.module, 'DESCRIPTION', self.name)
+
+    @property
+    def transactional(self):
+        return getattr(self.module, 'TRANSACTIONAL', True)
+
+
+class MigrationContext:
+    """Helpers handed to ``upgrade(ctx)``."""
+
+    def __init__(self, connection, dry_run=False, echo=print):
+        self.connection = connection
+        self.dialect = connection.dialect.name
+        self.dry_run = dry_run
+        self.echo = echo
+
+    def execute(self, sql, params=None):
+        if self.dry_run:
+            self.echo(f"{sql.strip()};" + (f"  -- {params}" if params else ''))
+            return None
+        return self.connection.execute(text(sql), params or {})
+
+    def inspector(self):
+        return inspect(self.connection)
+
+    def has_table(self, table):
+        return self.inspector().has_table(table)
+
+    def has_column(self, table, column):
+        return self.has_table(table) and any(c['name'] == column for c in self.inspector().get_columns(table))
+
+    def column_type(self, table, column):
+        for col in self.inspector().get_columns(table):
+            if col['name'] == column:
+                return col['type']
+        return None
+
+    def create_index(self, name, table, columns, unique=False, using=None):
+        """Create an index without blocking writes where the database allows it.
+
+        On PostgreSQL this is ``CREATE INDEX CONCURRENTLY IF NOT EXISTS`` and
+        must run in a non-transactional migration. An INVALID index left by a
+        previously interrupted concurrent build is dropped and rebuilt.
+        """
+        unique_sql = 'UNIQUE ' if unique else ''
+        if self.dialect == 'postgresql':
+            if not self.dry_run:
+                invalid = self.connection.execute(text(
+                    "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ), {'name': name}).first()
+                if invalid:
+                    self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            using_sql = f" USING {using}" if using else ''
+            return self.execute(
+                f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{using_sql} ({columns})"
+            )
+        return self.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    def backfill(self, table, set_sql, where_sql, batch_size=DEFAULT_BATCH_SIZE, key='id'):
+        """Run ``UPDATE table SET set_sql WHERE where_sql`` in primary-key batches.
+
+        Each batch is its own statement (and, in a non-transactional
+        migration, its own commit) so row locks stay short and a restart
+        resumes where it stopped. ``where_sql`` must stop matching rows
+        once they are updated.
+        """
+        sql = (
+            f"UPDATE {table} SET {set_sql} WHERE {key} IN "
+            f"(SELECT {key} FROM {table} WHERE {where_sql} ORDER BY {key} LIMIT :batch_size)"
+        )
+        if self.dry_run:
+            self.echo(f"-- repeat until no rows are updated:\n{sql};  -- batch_size={batch_size}")
+            return 0
+        total = 0
+        while True:
+            result = self.connection.execute(text(sql), {'batch_size': batch_size})
+            total += result.rowcount
+            if result.rowcount:
+                logger.info(f"{table}: {total} rows backfilled")
+            if result.rowcount < batch_size:
+                return total
+
+
+def discover_migrations(versions_dir=VERSIONS_DIR):
+    migrations = []
+    for path in sorted(glob.glob(os.path.join(versions_dir, '[0-9]*_*.py'))):
+        version, _, name = os.path.basename(path)[:-3].partition('_')
+        migrations.append(Migration(version, name, path))
+    return migrations
+
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(32) PRIMARY KEY, "
+            "description VARCHAR(255), "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def applied_versions(engine):
+    if not inspect(engine).has_table('schema_migrations'):
+        return set()
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending_migrations(engine, target=None):
+    applied = applied_versions(engine)
+    return [m for m in discover_migrations()
+            if m.version not in applied and (target is None or m.version <= target)]
+
+
+def _record(conn, migration):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+        {'v': migration.version, 'd': migration.description[:255], 't': datetime.utcnow()}
+    )
+
+
+def run_migrations(engine, dry_run=False, target=None, echo=print):
+    """Apply pending migrations in version order. Returns the versions applied."""
+    if not dry_run:
+        _ensure_version_table(engine)
+    applied = []
+    for migration in pending_migrations(engine, target):
+        echo(f"-- {migration.version}: {migration.description}")
+        if dry_run:
+            with engine.connect() as conn:
+                migration.module.upgrade(MigrationContext(conn, dry_run=True, echo=echo))
+            applied.append(migration.version)
+            continue
+
+        if migration.transactional:
+            with engine.begin() as conn:
+                migration.module.upgrade(MigrationContext(conn, echo=echo))
+                _record(conn, migration)
+        else:
+            # CONCURRENTLY and batched backfills cannot run inside one transaction
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                migration.module.upgrade(MigrationContext(conn, echo=echo))
+                _record(conn, migration)
+        logger.info(f"Migration {migration.version} applied")
+        applied.append(migration.version)
+    return applied
@@ -0,0 +1,15 @@
+from sqlalchemy.schema import CreateTable, CreateIndex
+from data.db import Base
+
+DESCRIPTION = "Create any missing tables from the current models"
+TRANSACTIONAL = True
+
+
+def upgrade(ctx):
+    dialect = ctx.connection.dialect
+    for table in Base.metadata.sorted_tables:
+        if ctx.has_table(table.name):
+            continue
+        ctx.execute(str(CreateTable(table).compile(dialect=dialect)))
+        for index in table.indexes:
+            ctx.execute(str(CreateIndex(index).compile(dialect=dialect)))
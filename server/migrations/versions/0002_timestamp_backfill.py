@@ -0,0 +1,31 @@
+from sqlalchemy import String
+
+DESCRIPTION = "Add timestamp columns for string created_at/updated_at and backfill them in batches"
+TRANSACTIONAL = False
+
+# Colunas que ainda podem estar como VARCHAR (ISO 8601) em bancos antigos
+COLUMNS = {
+    'logos': ['created_at'],
+    'images': ['created_at'],
+    'payments': ['created_at', 'updated_at'],
+    'chat_messages': ['created_at'],
+}
+
+
+def needs_conversion(ctx, table, column):
+    return ctx.has_table(table) and isinstance(ctx.column_type(table, column), String)
+
+
+def upgrade(ctx):
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            if not needs_conversion(ctx, table, column):
+                continue
+            new_column = f"{column}_ts"
+            if not ctx.has_column(table, new_column):
+                ctx.execute(f"ALTER TABLE {table} ADD COLUMN {new_column} TIMESTAMP")
+            if ctx.dialect == 'postgresql':
+                value = f"CAST({column} AS TIMESTAMP)"
+            else:
+                value = f"REPLACE({column}, 'T', ' ')"
+            ctx.backfill(table, f"{new_column} = {value}", f"{new_column} IS NULL AND {column} IS NOT NULL")
@@ -0,0 +1,40 @@
+from sqlalchemy import String
+
+DESCRIPTION = "Swap backfilled timestamp columns in place of the string columns"
+TRANSACTIONAL = True
+
+COLUMNS = {
+    'logos': ['created_at'],
+    'images': ['created_at'],
+    'payments': ['created_at', 'updated_at'],
+    'chat_messages': ['created_at'],
+}
+
+# Indexes on the string columns would follow the renamed legacy column;
+# they are dropped here and rebuilt concurrently by 0004.
+INDEXES = {
+    'logos': ['ix_logos_user_created'],
+    'images': ['ix_images_user_created'],
+    'chat_messages': ['ix_chat_messages_user_conversation_created'],
+}
+
+
+def upgrade(ctx):
+    for table, columns in COLUMNS.items():
+        if not ctx.has_table(table):
+            continue
+        pending = [c for c in columns
+                   if isinstance(ctx.column_type(table, c), String)
+                   and (ctx.dry_run or ctx.has_column(table, f"{c}_ts"))]
+        if not pending:
+            continue
+        for index in INDEXES.get(table, []):
+            ctx.execute(f"DROP INDEX IF EXISTS {index}")
+        for column in pending:
+            new_column = f"{column}_ts"
+            value = f"CAST({column} AS TIMESTAMP)" if ctx.dialect == 'postgresql' else f"REPLACE({column}, 'T', ' ')"
+            # Rows written since 0002 finished; a short tail inside this transaction
+            ctx.execute(f"UPDATE {table} SET {new_column} = {value} WHERE {new_column} IS NULL AND {column} IS NOT NULL")
+            # The string column is kept (renamed) rather than dropped
+            ctx.execute(f"ALTER TABLE {table} RENAME COLUMN {column} TO {column}_legacy")
+            ctx.execute(f"ALTER TABLE {table} RENAME COLUMN {new_column} TO {column}")
@@ -0,0 +1,14 @@
+DESCRIPTION = "Create pagination and session indexes without locking writes"
+TRANSACTIONAL = False
+
+
+def upgrade(ctx):
+    ctx.create_index('ix_chat_messages_user_conversation_created', 'chat_messages',
+                     'user_id, conversation_id, created_at, id')
+    ctx.create_index('ix_conversations_user_last_message', 'conversations',
+                     'user_id, last_message_at DESC, id DESC')
+    ctx.create_index('ix_logos_user_created', 'logos', 'user_id, created_at DESC, id DESC')
+    ctx.create_index('ix_images_user_created', 'images', 'user_id, created_at DESC, id DESC')
+    ctx.create_index('ix_posts_user_created', 'posts', 'user_id, created_at DESC, id DESC')
+    ctx.create_index('ix_user_sessions_user_id', 'user_sessions', 'user_id')
+    ctx.create_index('ix_user_sessions_expires_at', 'user_sessions', 'expires_at')
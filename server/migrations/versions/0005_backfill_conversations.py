@@ -0,0 +1,11 @@
+from data.db import backfill_conversations
+
+DESCRIPTION = "Build conversations rows for chat messages saved before the table existed"
+TRANSACTIONAL = False
+
+
+def upgrade(ctx):
+    if ctx.dry_run:
+        ctx.echo("-- INSERT INTO conversations ... (batched, from chat_messages grouped by conversation_id)")
+        return
+    backfill_conversations()
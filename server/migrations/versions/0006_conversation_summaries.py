@@ -0,0 +1,13 @@
+DESCRIPTION = "Add rolling summary columns to conversations"
+
+COLUMNS = {
+    'summary': 'TEXT',
+    'summary_until_id': 'INTEGER',
+    'summary_updated_at': 'TIMESTAMP',
+}
+
+
+def upgrade(ctx):
+    for column, column_type in COLUMNS.items():
+        if not ctx.has_column('conversations', column):
+            ctx.execute(f"ALTER TABLE conversations ADD COLUMN {column} {column_type}")
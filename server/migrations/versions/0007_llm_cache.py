@@ -0,0 +1,14 @@
+from sqlalchemy.schema import CreateTable, CreateIndex
+from data.db import LLMCacheEntry
+
+DESCRIPTION = "Create the shared LLM response cache table"
+
+
+def upgrade(ctx):
+    table = LLMCacheEntry.__table__
+    if ctx.has_table(table.name):
+        return
+    dialect = ctx.connection.dialect
+    ctx.execute(str(CreateTable(table).compile(dialect=dialect)))
+    for index in table.indexes:
+        ctx.execute(str(CreateIndex(index).compile(dialect=dialect)))
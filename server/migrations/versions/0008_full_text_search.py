@@ -0,0 +1,16 @@
+from data.search import FTS_TABLES, SEARCH_INDEXES, sqlite_fts_statements
+
+DESCRIPTION = "Add full-text search indexes on chat messages and posts"
+TRANSACTIONAL = False
+
+
+def upgrade(ctx):
+    if ctx.dialect == 'postgresql':
+        # Expression indexes: maintained by Postgres on every insert/update
+        for name, (table, vector) in SEARCH_INDEXES.items():
+            ctx.create_index(name, table, vector, using='gin')
+    elif ctx.dialect == 'sqlite':
+        # FTS5 tables with external content, kept in sync by triggers
+        for fts_table, (table, columns) in FTS_TABLES.items():
+            for sql in sqlite_fts_statements(fts_table, table, columns):
+                ctx.execute(sql)
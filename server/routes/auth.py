@@ -1,7 +1,9 @@
-from flask import request, jsonify, Blueprint, make_response, current_app
+from flask import request, jsonify, Blueprint, make_response, current_app, g
 import logging
 from werkzeug.security import check_password_hash
-from data.db import create_user, get_user_by_username, update_user_token, verify_token
+from data.db import create_user, get_user_by_username, create_user_session, verify_token, revoke_token, update_password_hash, SESSION_MAX_AGE
+from services.passwords import PasswordHasherBusy, hasher
+from data.signed_sessions import SESSION_TOKEN_MODE, issue_signed_token
 from datetime import datetime, timedelta
 import secrets
 
@@ -12,6 +14,78 @@ auth_bp = Blueprint('auth', __name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Endpoints acessíveis sem sessão; todos os demais exigem um cookie válido.
+PUBLIC_ENDPOINTS = frozenset({
+    'static',
+    'auth.signup',
+    'auth.login',
+    'auth.logout',
+    'auth.register',
+    'auth.verify_session',
+    'payment.webhook',
+    'trends.get_trending_topics',
+    'chat.uploaded_file',
+    'enhance.upscale_image',
+    'metrics.get_metrics',  # protegido por METRICS_TOKEN, não por sessão
+})
+
+def get_current_user():
+    """Resolve the session cookie into a SessionUser at most once per request."""
+    if 'user' not in g:
+        token = request.cookies.get('session')
+        g.user = verify_token(token) if token else None
+    return g.user
+
+def authenticate_request():
+    """App-level before_request hook registered in create_app.
+
+    Requests to endpoints outside PUBLIC_ENDPOINTS must carry a valid session;
+    handlers then read the identity from ``g.user``.
+    """
+    if request.method == 'OPTIONS' or request.endpoint is None:
+        return None
+    if request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+
+    if not request.cookies.get('session'):
+        return jsonify({'error': 'No authentication cookie'}), 401
+    if get_current_user() is None:
+        logger.warning(f"Invalid session for {request.method} {request.path}")
+        return jsonify({'error': 'Invalid session'}), 401
+    return None
+
+def hasher_busy_response():
+    """Resposta rápida quando o pool de hashing de senhas está saturado."""
+    response = jsonify({'error': 'Server busy, please try again'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def rehash_password_if_needed(user, password):
+    """Upgrade a stored hash to the current PASSWORD_HASH_METHOD after a successful login."""
+    if not hasher.needs_rehash(user.password_hash):
+        return
+    try:
+        if update_password_hash(user.id, hasher.hash(password)):
+            hasher.rehashed += 1
+            logger.info(f"Password hash upgraded for user {user.username}")
+    except PasswordHasherBusy:
+        logger.info(f"Skipping password rehash for {user.username}: hashing pool busy")
+
+def start_session(username, user_id=None):
+    """Cria a sessão do usuário e retorna o token do cookie (ou None em caso de erro)."""
+    if SESSION_TOKEN_MODE == 'signed':
+        if user_id is None:
+            user = get_user_by_username(username)
+            if user is None:
+                return None
+            user_id = user.id
+        return issue_signed_token(user_id, username)
+
+    session_token = secrets.token_urlsafe(32)
+    if create_user_session(username, session_token) is None:
+        return None
+    return session_token
+
 @auth_bp.route('/signup', methods=['POST'])
 def signup():
     """Cadastro de um novo usuário."""
@@ -49,8 +123,9 @@ def signup():
             return jsonify({'errors': {'general': 'Error creating user'}}), 500
 
         # Generate and set session token
-        session_token = secrets.token_urlsafe(32)
-        user = update_user_token(username, session_token)
+        session_token = start_session(username)
+        if session_token is None:
+            return jsonify({'errors': {'general': 'Error creating session'}}), 500
 
         response = make_response(jsonify({
             'message': 'Signup successful',
@@ -64,13 +139,15 @@ def signup():
             httponly=True,
             secure=False,  # Development setting False, Production True                 
             samesite='Lax',
-            max_age=3600,
+            max_age=SESSION_MAX_AGE,
             path='/'
         )
 
         logger.info(f"User {username} signed up successfully")
         return response, 201
         
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     except Exception as e:
         logger.exception(f"Error during signup: {e}")
         return jsonify({'errors': {'general': 'Internal server error'}}), 500
@@ -84,8 +161,10 @@ def login():
 
         user = get_user_by_username(username)
         if user and user.check_password(password):
-            session_token = secrets.token_urlsafe(32)
-            user = update_user_token(username, session_token)
+            rehash_password_if_needed(user, password)
+            session_token = start_session(username, user_id=user.id)
+            if session_token is None:
+                return jsonify({'error': 'Error creating session'}), 500
 
             response = make_response(jsonify({
                 'success': True,
@@ -99,19 +178,25 @@ def login():
                 httponly=True,
                 secure=True,
                 samesite='Lax',
-                max_age=3600,
+                max_age=SESSION_MAX_AGE,
                 path='/',
                 domain=None  # This will use the current domain
             )
             return response
 
         return jsonify({'error': 'Invalid credentials'}), 401
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     except Exception as e:
         logger.error(f"Login error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
+    token = request.cookies.get('session')
+    if token:
+        revoke_token(token)
+
     response = make_response(jsonify({'success': True}))
     response.delete_cookie('session', path='/', domain=None)
     return response
@@ -130,8 +215,9 @@ def register():
         user = create_user(username, email, password)
         if user:
             # Generate and set session token
-            session_token = secrets.token_urlsafe(32)
-            user = update_user_token(username, session_token)
+            session_token = start_session(username)
+            if session_token is None:
+                return jsonify({'error': 'Error creating session'}), 500
 
             response = make_response(jsonify({
                 'message': 'User created successfully',
@@ -145,12 +231,14 @@ def register():
                 httponly=True,
                 secure=False,  # Changed to False for development
                 samesite='Lax',
-                max_age=3600,
+                max_age=SESSION_MAX_AGE,
                 path='/'
             )
             return response, 201
 
         return jsonify({'error': 'Error creating user'}), 500
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     except Exception as e:
         logger.exception(f"Registration error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -158,31 +246,16 @@ def register():
 @auth_bp.route('/protected', methods=['GET'])
 def protected():
     """Rota protegida que requer autenticação."""
-    try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No session cookie'}), 401
-
-        user = verify_token(token)
-        if user:
-            return jsonify({
-                'authenticated': True,
-                'username': user.username,
-                'message': f'Welcome, {user.username}! Create your Logo with LogixAI.'
-            }), 200
-        else:
-            return jsonify({'error': 'Invalid session'}), 403
-    except Exception as e:
-        logger.exception(f"Error accessing protected route: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+    user = g.user
+    return jsonify({
+        'authenticated': True,
+        'username': user.username,
+        'message': f'Welcome, {user.username}! Create your Logo with LogixAI.'
+    }), 200
 
 @auth_bp.route('/verify-session', methods=['GET'])
 def verify_session():
-    token = request.cookies.get('session')
-    if not token:
-        return jsonify({'authenticated': False}), 401
-    
-    user = verify_token(token)
+    user = get_current_user()
     if user:
         return jsonify({
             'authenticated': True,
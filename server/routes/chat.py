@@ -1,127 +1,212 @@
-from flask import Blueprint, request, jsonify, send_from_directory # Importe send_from_directory
-from data.db import verify_token, save_chat_message, get_chat_history
+from flask import Blueprint, request, jsonify, send_from_directory, g, Response, stream_with_context, current_app # Importe send_from_directory
+from data.db import save_chat_message, get_chat_history, list_conversations, get_conversation_messages, commit_request_session
+from routes.pagination import get_page_args
+from services.chat_context import build_context
+from services import llm_gateway
+from services.llm_cache import cached_completion, cache_bypassed
+from services.limiter import Overloaded
+from routes.errors import overloaded_response
+from routes.single_flight import single_flight
+from services.vision import VISION_HISTORY_IMAGES, vision_content, vision_deployment
+from services.uploads import UPLOAD_DIR, UploadTooLarge, content_path, legacy_path, save_upload
+import json
 import logging
+import mimetypes
 import os
 import time
-from openai import AzureOpenAI
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, send_file
 import uuid # Importa para gerar IDs de conversa
 
 load_dotenv()
 chat_bp = Blueprint('chat', __name__, url_prefix='/chat')
 logger = logging.getLogger(__name__)
 
-# Cliente Azure OpenAI
-client = AzureOpenAI(
-    api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-    api_version="2024-12-01-preview",
-    azure_endpoint=os.getenv('AZURE_OPENAI_API_ENDPOINT')
-)
+def chat_completion_args(prompt_for_ai, summary=None, history=(), image_path=None):
+    """Arguments of the completion call, shared by the sync and async routes.
+
+    ``summary`` and ``history`` come from services.chat_context.build_context.
+    The attached image, and those of the newest VISION_HISTORY_IMAGES earlier
+    turns, are sent as downscaled vision inputs (see services.vision); this
+    may read/encode images, so async callers run it in a thread.
+    """
+    messages = [{"role": "system", "content": "Você é um assistente útil."}]
+    if summary:
+        messages.append({"role": "system", "content": f"Resumo da conversa até aqui:\n{summary}"})
+
+    # Imagens só nos turnos de usuário mais recentes
+    images_left = VISION_HISTORY_IMAGES
+    turns = []
+    for message in reversed(history):
+        content = message['content']
+        if images_left > 0 and message['role'] == 'user' and message.get('image_path'):
+            images_left -= 1
+            content = vision_content(content, message['image_path'])
+        turns.append({"role": message['role'], "content": content})
+    messages.extend(reversed(turns))
+
+    messages.append({"role": "user", "content": vision_content(prompt_for_ai, image_path)}) # Usa o prompt com referência à imagem
+    has_image = any(not isinstance(message['content'], str) for message in messages)
+    return {
+        'model': vision_deployment() if has_image else os.getenv('AZURE_OPENAI_DEPLOYMENT'),
+        'messages': messages,
+        'temperature': 0.7,
+        'max_tokens': 512
+    }
+
+def warm_up():
+    llm_gateway.warm_up()
+
+# Entrega dos anexos: '' (Flask envia o arquivo), 'x-accel' (nginx, via
+# X-Accel-Redirect para UPLOAD_ACCEL_PREFIX) ou 'x-sendfile' (Apache/lighttpd)
+UPLOAD_OFFLOAD = os.getenv('UPLOAD_OFFLOAD', '')
+UPLOAD_ACCEL_PREFIX = os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600
 
 # Rota para servir arquivos da pasta 'uploads'
 @chat_bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    # Certifique-se de que a pasta 'uploads' existe e está na raiz do seu projeto Flask
-    return send_from_directory(os.path.join(os.getcwd(), 'uploads'), filename)
+    path = content_path(filename)
+    if path is None:
+        # Anexos antigos, gravados pelo nome original: comportamento anterior
+        if legacy_path(filename) is None:
+            return jsonify({'error': 'Not found'}), 404
+        return send_from_directory(UPLOAD_DIR, filename)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'Not found'}), 404
+
+    # O nome é o hash do conteúdo: ETag forte e cache permanente
+    digest = filename.split('.', 1)[0]
+    if UPLOAD_OFFLOAD == 'x-accel':
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(digest)
+        response.make_conditional(request)
+        if response.status_code != 304:
+            relative = os.path.relpath(path, UPLOAD_DIR).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = UPLOAD_ACCEL_PREFIX.rstrip('/') + '/' + relative
+    else:
+        response = send_file(
+            path, request.environ,
+            etag=digest,
+            conditional=True,  # Range e If-None-Match
+            max_age=UPLOAD_CACHE_MAX_AGE,
+            use_x_sendfile=UPLOAD_OFFLOAD == 'x-sendfile',
+            response_class=current_app.response_class
+        )
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+
+def _start_chat(user):
+    """Validate the form, store the upload and save the user message.
+
+    Shared by /chat and /chat/stream; returns ``(context, None)`` or
+    ``(None, error_response)``.
+    """
+    # Get form data
+    prompt = request.form.get('prompt', '').strip()
+    image = request.files.get('image')
+    conversation_id = request.form.get('conversation_id')
+    
+    # Log received data
+    logger.debug(f"Prompt: {prompt}")
+    logger.debug(f"Image: {True if image else False}")
+    logger.debug(f"Conversation ID: {conversation_id}")
 
+    # Validate input
+    if not prompt and not image:
+        return None, (jsonify({'error': 'Prompt or image is required'}), 400)
+    if prompt and len(prompt) > 2000:
+        return None, (jsonify({'error': 'Prompt is too long'}), 400)
+
+    # Handle image and prepare prompt
+    filename = None
+    prompt_for_ai = prompt  # Define prompt_for_ai before use
+    
+    if image:
+        try:
+            # Gravado pelo hash do conteúdo enquanto é lido
+            filename = save_upload(image.stream, image.filename)
+            # Update prompt_for_ai with image context
+            prompt_for_ai = f"{prompt}\n[Imagem anexada: {secure_filename(image.filename) or filename}]"
+        except UploadTooLarge as e:
+            return None, (jsonify({'error': str(e)}), 413)
+        except Exception as e:
+            logger.error(f"Error saving image: {e}")
+            return None, (jsonify({'error': 'Failed to save image'}), 500)
+
+    # Histórico da conversa (antes de salvar a nova mensagem)
+    summary, history = build_context(user.id, conversation_id, prompt_for_ai)
+
+    # Save user message with debug logging
+    try:
+        if conversation_id:
+            logger.debug(f"Using existing conversation_id: {conversation_id}")
+        else:
+            conversation_id = str(uuid.uuid4())
+            logger.debug(f"Generated new conversation_id: {conversation_id}")
+
+        logger.debug(f"Attempting to save message with: user_id={user.id}, content_length={len(prompt)}")
+        
+        returned_message = save_chat_message(
+            user_id=user.id,
+            role='user',
+            content=prompt,
+            conversation_id=conversation_id,
+            image_path=filename if image else None
+        )
+        
+        if not returned_message:
+            logger.error("save_chat_message returned None - database operation failed")
+            raise Exception("Database operation failed")
+            
+        # Commit now so the connection is not held during the LLM call
+        commit_request_session()
+        logger.info(f"Message saved successfully with conversation_id: {conversation_id}")
+        
+    except Exception as e:
+        logger.exception(f"Failed to save message: {str(e)}")
+        return None, (jsonify({'error': f'Database error: {str(e)}'}), 500)
+
+    return {
+        'prompt_for_ai': prompt_for_ai,
+        'summary': summary,
+        'history': history,
+        'conversation_id': conversation_id,
+        'image_path': filename
+    }, None
 
 @chat_bp.route('/chat', methods=['POST'])
+@single_flight
 def chat():
     try:
         # Log request details
         logger.info("Received chat request")
         
-        # Authentication
-        token = request.cookies.get('session')
-        if not token:
-            logger.warning("No authentication cookie found")
-            return jsonify({'error': 'No authentication cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            logger.warning("Invalid session token")
-            return jsonify({'error': 'Invalid session'}), 401
+        # Usuário autenticado pelo middleware (routes.auth.authenticate_request)
+        user = g.user
         
         # Log authenticated user
         logger.info(f"Authenticated user: {user.id}")
-        
-        # Get form data
-        prompt = request.form.get('prompt', '').strip()
-        image = request.files.get('image')
-        conversation_id = request.form.get('conversation_id')
-        
-        # Log received data
-        logger.debug(f"Prompt: {prompt}")
-        logger.debug(f"Image: {True if image else False}")
-        logger.debug(f"Conversation ID: {conversation_id}")
-
-        # Validate input
-        if not prompt and not image:
-            return jsonify({'error': 'Prompt or image is required'}), 400
-        if prompt and len(prompt) > 2000:
-            return jsonify({'error': 'Prompt is too long'}), 400
-
-        # Handle image and prepare prompt
-        filename = None
-        prompt_for_ai = prompt  # Define prompt_for_ai before use
-        
-        if image:
-            try:
-                filename = secure_filename(image.filename)
-                upload_dir = os.path.join(os.getcwd(), 'uploads')
-                os.makedirs(upload_dir, exist_ok=True)
-                image.save(os.path.join(upload_dir, filename))
-                # Update prompt_for_ai with image context
-                prompt_for_ai = f"{prompt}\n[Imagem anexada: {filename}]"
-            except Exception as e:
-                logger.error(f"Error saving image: {e}")
-                return jsonify({'error': 'Failed to save image'}), 500
-
-        # Save user message with debug logging
-        try:
-            if conversation_id:
-                logger.debug(f"Using existing conversation_id: {conversation_id}")
-            else:
-                conversation_id = str(uuid.uuid4())
-                logger.debug(f"Generated new conversation_id: {conversation_id}")
 
-            logger.debug(f"Attempting to save message with: user_id={user.id}, content_length={len(prompt)}")
-            
-            returned_message = save_chat_message(
-                user_id=user.id,
-                role='user',
-                content=prompt,
-                conversation_id=conversation_id,
-                image_path=filename if image else None
-            )
-            
-            if not returned_message:
-                logger.error("save_chat_message returned None - database operation failed")
-                raise Exception("Database operation failed")
-                
-            logger.info(f"Message saved successfully with conversation_id: {conversation_id}")
-            
-        except Exception as e:
-            logger.exception(f"Failed to save message: {str(e)}")
-            return jsonify({'error': f'Database error: {str(e)}'}), 500
+        context, error = _start_chat(user)
+        if error:
+            return error
+        conversation_id = context['conversation_id']
 
         # Call Azure OpenAI
         try:
             # Chamada Azure OpenAI
-            start = time.time()
-            response = client.chat.completions.create(
-                model=os.getenv('AZURE_OPENAI_DEPLOYMENT'),
-                messages=[
-                    {"role": "system", "content": "Você é um assistente útil."},
-                    {"role": "user", "content": prompt_for_ai} # Usa o prompt com referência à imagem
-                ],
-                temperature=0.7,
-                max_tokens=512
-            )
-            duration_ms = int((time.time() - start) * 1000)
-
-            generated_text = response.choices[0].message.content
+            try:
+                args = chat_completion_args(context['prompt_for_ai'], context['summary'], context['history'], context['image_path'])
+                generated_text, duration_ms, cached = cached_completion(
+                    args, use_cache=not cache_bypassed(request.headers)
+                )
+            except Overloaded as e:
+                return overloaded_response(e)
 
             # Save AI response with improved error handling
             assistant_message = save_chat_message(
@@ -136,11 +221,12 @@ def chat():
                 raise Exception("Database error: Could not save assistant response")
 
             return jsonify({
-                'model': os.getenv('AZURE_OPENAI_DEPLOYMENT'),
+                'model': args['model'],
                 'duration_ms': duration_ms,
+                'cached': cached,
                 'response': generated_text,
                 'conversation_id': conversation_id,
-                'image_path': filename if image else None
+                'image_path': context['image_path']
             }), 200
 
         except Exception as e:
@@ -151,16 +237,96 @@ def chat():
         logger.exception("Unexpected error in chat endpoint")
         return jsonify({'error': str(e)}), 500
 
+def sse_event(data, event=None):
+    """Format one server-sent event; ``data`` is sent as JSON."""
+    payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+def chunk_text(chunk):
+    """Text delta of a streamed completion chunk ('' for filter/role chunks)."""
+    if not chunk.choices:
+        return ''
+    return chunk.choices[0].delta.content or ''
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Evita que o nginx segure os eventos em buffer
+    'X-Accel-Buffering': 'no'
+}
+
+@chat_bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /chat: forwards completion deltas as SSE.
+
+    Events: ``start`` (conversation_id), unnamed ``{"delta": ...}`` chunks,
+    then ``done`` with ttft_ms/duration_ms, or ``error``. The assistant
+    message is saved when the stream ends, or with the partial text if the
+    client disconnects first.
+    """
+    try:
+        user = g.user
+        context, error = _start_chat(user)
+        if error:
+            return error
+        conversation_id = context['conversation_id']
+
+        # Abre o stream antes de responder, para sobrecarga virar um 503
+        start = time.time()
+        try:
+            args = chat_completion_args(context['prompt_for_ai'], context['summary'], context['history'], context['image_path'])
+            stream = llm_gateway.complete(stream=True, **args)
+        except Overloaded as e:
+            return overloaded_response(e)
+
+        def generate():
+            parts = []
+            try:
+                yield sse_event({'conversation_id': conversation_id, 'model': args['model']}, 'start')
+                ttft_ms = None
+                for chunk in stream:
+                    text = chunk_text(chunk)
+                    if not text:
+                        continue
+                    if ttft_ms is None:
+                        ttft_ms = int((time.time() - start) * 1000)
+                    parts.append(text)
+                    yield sse_event({'delta': text})
+                yield sse_event({
+                    'ttft_ms': ttft_ms,
+                    'duration_ms': int((time.time() - start) * 1000),
+                    'conversation_id': conversation_id,
+                    'image_path': context['image_path']
+                }, 'done')
+            except GeneratorExit:
+                logger.info(f"Client disconnected from chat stream {conversation_id}")
+                raise
+            except Exception as e:
+                logger.error(f"Error in chat stream: {str(e)}")
+                yield sse_event({'error': 'Internal server error'}, 'error')
+            finally:
+                # Libera o slot do limitador e, se o cliente saiu, interrompe a geração no Azure
+                stream.close()
+                if parts:
+                    try:
+                        save_chat_message(user_id=user.id, role='assistant', content=''.join(parts), conversation_id=conversation_id)
+                        # after_request already ran: commit explicitly
+                        commit_request_session()
+                    except Exception as e:
+                        logger.exception(f"Failed to save streamed assistant message: {str(e)}")
+
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+        # Se o gerador nunca chegar a rodar, o slot ainda é devolvido
+        response.call_on_close(stream.close)
+        return response
+
+    except Exception as e:
+        logger.exception("Unexpected error in chat stream endpoint")
+        return jsonify({'error': str(e)}), 500
+
 @chat_bp.route('/history', methods=['GET'])
 def get_history_route(): # Renomeado para evitar conflito com a função get_chat_history do db.py
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-        
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         # get_chat_history agora retorna um array de objetos de conversa
         history = get_chat_history(user.id) 
@@ -168,4 +334,38 @@ def get_history_route(): # Renomeado para evitar conflito com a função get_cha
 
     except Exception as e:
         logger.exception("Error fetching chat history")
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/conversations', methods=['GET'])
+def get_conversations_route():
+    """Lista paginada de conversas (mais recentes primeiro)."""
+    try:
+        user = g.user
+        limit, cursor = get_page_args(default_limit=20, max_limit=100)
+        conversations, next_cursor = list_conversations(user.id, limit=limit, cursor=cursor)
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor}), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error listing conversations")
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/conversations/<conversation_id>/messages', methods=['GET'])
+def get_conversation_messages_route(conversation_id):
+    """Mensagens de uma conversa, paginadas da mais recente para a mais antiga."""
+    try:
+        user = g.user
+        limit, cursor = get_page_args(default_limit=50, max_limit=200)
+        messages, next_cursor = get_conversation_messages(user.id, conversation_id, limit=limit, cursor=cursor)
+        return jsonify({
+            'conversation_id': conversation_id,
+            'messages': messages,
+            'next_cursor': next_cursor
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error fetching conversation messages")
+        return jsonify({'error': str(e)}), 500
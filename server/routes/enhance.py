@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 from flask import Blueprint, request, jsonify, send_file
 from PIL import Image
 import numpy as np
@@ -13,16 +14,13 @@ logger = logging.getLogger(__name__)
 realesrgan_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models', 'Real-ESRGAN')
 sys.path.append(realesrgan_path)
 
-try:
-    from realesrgan import RealESRGANer
-    from basicsr.archs.rrdbnet_arch import RRDBNet
-except ImportError as e:
-    logger.error(f"Error importing Real-ESRGAN: {e}")
-    raise
-
 enhance_bp = Blueprint('enhance', __name__, url_prefix='/enhance')
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# torch/basicsr e os pesos do modelo só são carregados no primeiro uso
+# (ou em warm_up), para não pesar no boot dos workers.
+_upsampler = None
+_upsampler_lock = threading.Lock()
 
 def download_model():
     model_url = "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth"
@@ -39,24 +37,41 @@ def download_model():
     
     return model_path
 
-# Inicializar o modelo
-try:
-    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-    model_path = download_model()
-    
-    upsampler = RealESRGANer(
-        scale=4,
-        model_path=model_path,
-        model=model,
-        tile=0,
-        tile_pad=10,
-        pre_pad=0,
-        half=False # Use half precision if available
-    )
-    logger.info("Real-ESRGAN model loaded successfully")
-except Exception as e:
-    logger.error(f"Error initializing model: {e}")
-    raise
+def get_upsampler():
+    """Inicializa o modelo Real-ESRGAN uma única vez por processo."""
+    global _upsampler
+    if _upsampler is not None:
+        return _upsampler
+    with _upsampler_lock:
+        if _upsampler is None:
+            try:
+                from realesrgan import RealESRGANer
+                from basicsr.archs.rrdbnet_arch import RRDBNet
+            except ImportError as e:
+                logger.error(f"Error importing Real-ESRGAN: {e}")
+                raise
+
+            try:
+                model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
+                model_path = download_model()
+
+                _upsampler = RealESRGANer(
+                    scale=4,
+                    model_path=model_path,
+                    model=model,
+                    tile=0,
+                    tile_pad=10,
+                    pre_pad=0,
+                    half=False # Use half precision if available
+                )
+                logger.info("Real-ESRGAN model loaded successfully")
+            except Exception as e:
+                logger.error(f"Error initializing model: {e}")
+                raise
+    return _upsampler
+
+def warm_up():
+    get_upsampler()
 
 @enhance_bp.route('/upscale', methods=['POST'])
 def upscale_image():
@@ -64,6 +79,7 @@ def upscale_image():
         return jsonify({'error': 'No image provided'}), 400
 
     file = request.files['image']
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     input_path = os.path.join(UPLOAD_FOLDER, file.filename)
     output_path = os.path.join(UPLOAD_FOLDER, f"upscaled_{file.filename}")
 
@@ -75,7 +91,7 @@ def upscale_image():
     img_np = np.array(img)
 
     try:
-        output, _ = upsampler.enhance(img_np, outscale=4)
+        output, _ = get_upsampler().enhance(img_np, outscale=4)
         Image.fromarray(output).save(output_path)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,8 @@
+from flask import jsonify
+
+
+def overloaded_response(error):
+    """Resposta rápida quando o limitador de chamadas ao modelo descarta a requisição."""
+    response = jsonify({'error': 'Server busy, please try again'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
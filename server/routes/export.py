@@ -0,0 +1,41 @@
+from flask import Blueprint, request, jsonify, g, Response
+from data.export import SECTIONS, export_stream
+from datetime import datetime
+import logging
+
+export_bp = Blueprint('export', __name__)
+logger = logging.getLogger(__name__)
+
+@export_bp.route('/export', methods=['GET'])
+def export_history():
+    """Histórico completo do usuário em NDJSON, gerado durante o envio.
+
+    ``?include=chat_messages,posts`` escolhe as seções; ``?compress=gzip``
+    devolve um arquivo .ndjson.gz comprimido em tempo real.
+    """
+    try:
+        user = g.user
+        include = request.args.get('include')
+        sections = [s.strip() for s in include.split(',') if s.strip()] if include else list(SECTIONS)
+        if not sections or any(section not in SECTIONS for section in sections):
+            return jsonify({'error': f"include must be a subset of {','.join(SECTIONS)}"}), 400
+        compress = request.args.get('compress')
+        if compress not in (None, '', 'gzip'):
+            return jsonify({'error': 'Invalid compress'}), 400
+
+        filename = f"logixai-export-{datetime.utcnow():%Y%m%d}.ndjson"
+        mimetype = 'application/x-ndjson'
+        if compress:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        # O gerador abre a própria sessão: não depende do contexto da requisição
+        response = Response(export_stream(user.id, sections, compress=bool(compress)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception as e:
+        logger.exception("Error starting export")
+        return jsonify({'error': str(e)}), 500
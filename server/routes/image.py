@@ -1,36 +1,20 @@
-from flask import request, jsonify, Blueprint, Response
+from flask import request, jsonify, Blueprint, Response, g
 import logging
 import urllib.parse
-from data.db import save_image, get_user_images, delete_image, verify_token
+from data.db import save_image, get_user_images, delete_image, isoformat
+from routes.pagination import get_page_args
 import requests
 
 image_bp = Blueprint('image', __name__)
 logger = logging.getLogger(__name__)
 
-@image_bp.before_request
-def before_request():
-    if request.method == 'OPTIONS':
-        return '', 204
-    
-    token = request.cookies.get('session')
-    if not token and request.path not in ['/login', '/register']:
-        return jsonify({'error': 'No authentication cookie'}), 401
-
-    request.token = token
-
 @image_bp.route('/generate_image', methods=['POST', 'OPTIONS'])
 def generate_image():
     if request.method == 'OPTIONS':
         return '', 204
         
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         data = request.get_json()
         prompt = data.get('prompt')
@@ -61,15 +45,10 @@ def generate_image():
 @image_bp.route('/user_images', methods=['GET'])
 def get_images():
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No session cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
-        images = get_user_images(user.id)
+        limit, cursor = get_page_args(default_limit=50, max_limit=100)
+        images, next_cursor = get_user_images(user.id, limit=limit, cursor=cursor)
         
         return jsonify({
             'images': [{
@@ -77,10 +56,13 @@ def get_images():
                 'prompt': image.prompt,
                 'style': image.style,
                 'image_url': image.image_url,
-                'created_at': image.created_at
-            } for image in images]
+                'created_at': isoformat(image.created_at)
+            } for image in images],
+            'next_cursor': next_cursor
         }), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception("Error fetching images")
         return jsonify({'error': str(e)}), 500
@@ -88,13 +70,7 @@ def get_images():
 @image_bp.route('/delete_image/<int:image_id>', methods=['DELETE'])
 def remove_image(image_id):
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No session cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         if delete_image(image_id, user.id):
             return jsonify({'message': 'Image deleted successfully'}), 200
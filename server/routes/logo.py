@@ -1,31 +1,21 @@
-from flask import request, jsonify, Blueprint, send_file, Response, current_app
+from flask import request, jsonify, Blueprint, send_file, Response, current_app, g
 import logging
 import re
 import urllib.parse
 from math import sqrt
 import requests
 from io import BytesIO
-from data.db import save_logo, get_user_logos, delete_logo, verify_token
+from data.db import save_logo, get_user_logos, delete_logo, isoformat
+from routes.pagination import get_page_args
+from routes.single_flight import single_flight
 
 logo_bp = Blueprint('logo', __name__)
 
 # Configuração do logger
 logger = logging.getLogger(__name__)
 
-@logo_bp.before_request
-def before_request():
-    if request.method == 'OPTIONS':
-        return '', 204
-    
-    # Get token from secure cookie instead of headers
-    token = request.cookies.get('session')
-    if not token and request.path not in ['/login', '/register']:
-        return jsonify({'error': 'No authentication cookie'}), 401
-
-    request.token = token
-    logger.info(f"Incoming request: {request.method} {request.path}")
-
 @logo_bp.route('/generate_logo', methods=['POST', 'OPTIONS'])
+@single_flight
 def generate_logo():
     if request.method == 'OPTIONS':
         return '', 204
@@ -33,14 +23,7 @@ def generate_logo():
     Gera um logo com base nas informações fornecidas pelo usuário.
     """
     try:
-        # Verify user authentication from cookie
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         data = request.get_json()
         company_name = data.get('companyName')
@@ -120,19 +103,14 @@ def download_logo():
 
 @logo_bp.route('/user_logos', methods=['GET', 'OPTIONS'])
 def get_logos():
-    """Get user logos"""
+    """Get a page of user logos (``limit``/``cursor`` query params)"""
     if request.method == 'OPTIONS':
         return '', 204
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No session cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
-        logos = get_user_logos(user.id)
+        limit, cursor = get_page_args(default_limit=50, max_limit=100)
+        logos, next_cursor = get_user_logos(user.id, limit=limit, cursor=cursor)
         logger.info(f"Found {len(logos)} logos for user {user.id}")
         
         return jsonify({
@@ -143,10 +121,13 @@ def get_logos():
                 'style': logo.style,
                 'color': logo.color,
                 'image_url': logo.image_url,
-                'created_at': logo.created_at
-            } for logo in logos]
+                'created_at': isoformat(logo.created_at)
+            } for logo in logos],
+            'next_cursor': next_cursor
         }), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception("Error fetching logos")
         return jsonify({'error': str(e)}), 500
@@ -156,13 +137,7 @@ def remove_logo(logo_id):
     if request.method == 'OPTIONS':
         return '', 204
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No session cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         if delete_logo(logo_id, user.id):
             return jsonify({'message': 'Logo deleted successfully'}), 200
@@ -1,22 +1,30 @@
 import os
 from dotenv import load_dotenv
-import mercadopago
 import logging
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-# Get the access token and validate it
-access_token = os.getenv('MERCADOPAGO_ACCESS_TOKEN')
-if not access_token:
-    logger.error("MERCADOPAGO_ACCESS_TOKEN not found in environment variables")
-    raise ValueError("MERCADOPAGO_ACCESS_TOKEN is required")
+_sdk = None
 
-try:
-    sdk = mercadopago.SDK(str(access_token))
-except Exception as e:
-    logger.error(f"Failed to initialize MercadoPago SDK: {e}")
-    raise
+def get_sdk():
+    """Create the MercadoPago SDK on first use."""
+    global _sdk
+    if _sdk is None:
+        import mercadopago
+
+        # Get the access token and validate it
+        access_token = os.getenv('MERCADOPAGO_ACCESS_TOKEN')
+        if not access_token:
+            logger.error("MERCADOPAGO_ACCESS_TOKEN not found in environment variables")
+            raise ValueError("MERCADOPAGO_ACCESS_TOKEN is required")
+
+        try:
+            _sdk = mercadopago.SDK(str(access_token))
+        except Exception as e:
+            logger.error(f"Failed to initialize MercadoPago SDK: {e}")
+            raise
+    return _sdk
 
 def create_preference(title, description, price, external_reference):
     try:
@@ -41,7 +49,7 @@ def create_preference(title, description, price, external_reference):
         }
 
 
-        preference_response = sdk.preference().create(preference_data)
+        preference_response = get_sdk().preference().create(preference_data)
         return preference_response["response"]
     except Exception as e:
         logger.error(f"MercadoPago preference creation error: {e}")
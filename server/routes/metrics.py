@@ -0,0 +1,25 @@
+from flask import Blueprint, jsonify, request
+from services.metrics import snapshot
+import hmac
+import os
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Segredo compartilhado com o coletor de métricas (Authorization: Bearer ...).
+# Sem METRICS_TOKEN o endpoint fica desligado.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+def _authorized():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Contadores internos (caches, filas, limites) do processo atual."""
+    if not METRICS_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not _authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(snapshot()), 200
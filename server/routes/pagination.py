@@ -0,0 +1,17 @@
+from flask import request
+
+
+def get_page_args(default_limit=20, max_limit=100):
+    """Read ``limit``/``cursor`` query parameters.
+
+    Returns ``(limit, cursor)``; raises ValueError for a non-numeric limit.
+    The limit is clamped to ``1..max_limit``.
+    """
+    limit = request.args.get('limit', default_limit, type=str)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid limit")
+    limit = max(1, min(limit, max_limit))
+    cursor = request.args.get('cursor') or None
+    return limit, cursor
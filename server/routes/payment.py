@@ -1,5 +1,5 @@
-from flask import Blueprint, request, jsonify
-from data.db import verify_token, create_payment, update_payment_status, get_payment_by_reference
+from flask import Blueprint, request, jsonify, g
+from data.db import create_payment, update_payment_status, get_payment_by_reference
 import stripe
 import os
 from dotenv import load_dotenv
@@ -12,13 +12,7 @@ stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 @payment_bp.route('/create-checkout-session', methods=['POST'])
 def create_checkout_session():
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         # Create Stripe checkout session with proper price ID and URLs
         checkout_session = stripe.checkout.Session.create(
@@ -1,54 +1,190 @@
-from flask import Blueprint, request, jsonify
-from data.db import verify_token
+from flask import Blueprint, request, jsonify, g, Response, stream_with_context
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from data.db import commit_request_session
+from services import llm_gateway
+from services.llm_cache import cached_completion, cache_bypassed
+from services.limiter import Overloaded
+from routes.errors import overloaded_response
+from routes.single_flight import single_flight
+from routes.chat import sse_event, SSE_HEADERS
 import os
-from openai import AzureOpenAI
 import logging
+import time
 
 post_bp = Blueprint('post', __name__, url_prefix='/post')
 logger = logging.getLogger(__name__)
 
-client = AzureOpenAI(
-    api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-    api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
-    azure_endpoint=os.getenv('AZURE_OPENAI_API_ENDPOINT')
-    
-)
+# /post/generate/batch: várias variantes (formato, tom, tamanho) do mesmo
+# tópico geradas em paralelo, no máximo POST_BATCH_CONCURRENCY por requisição
+POST_BATCH_MAX_VARIANTS = int(os.getenv('POST_BATCH_MAX_VARIANTS', '8'))
+POST_BATCH_CONCURRENCY = int(os.getenv('POST_BATCH_CONCURRENCY', '4'))
 
+def post_completion_args(data):
+    """Arguments of the completion call, shared by the sync and async routes."""
+    return {
+        'model': os.getenv('AZURE_OPENAI_DEPLOYMENT'),
+        'messages': [
+            {"role": "system", "content": "You are a professional content writer, expecialist in social media, entire thing that you ask need to be very smart, attetion on it."},
+            {"role": "user", "content": f"Create a {data.get('format', 'blog post')} about {data['topic']} "
+                                      f"in a {data.get('tone', 'professional')} tone, "
+                                      f"with approximately {data.get('wordCount', 300)} words."}
+                                      
+        ],
+        'temperature': 0.7,
+        'max_tokens': 1000
+    }
 
+def parse_batch(data):
+    """Validate a batch request; returns ``(variants, error)``.
 
+    Each variant is a /post/generate payload: the shared ``topic`` plus that
+    variant's ``format``, ``tone`` and ``wordCount``.
+    """
+    if not data or not data.get('topic'):
+        return None, 'Topic is required'
+    variants = data.get('variants')
+    if not isinstance(variants, list) or not variants:
+        return None, 'variants must be a non-empty list'
+    if len(variants) > POST_BATCH_MAX_VARIANTS:
+        return None, f"At most {POST_BATCH_MAX_VARIANTS} variants per batch"
+    parsed = []
+    for variant in variants:
+        if not isinstance(variant, dict):
+            return None, 'Each variant must be an object'
+        try:
+            word_count = int(variant.get('wordCount', 300))
+        except (TypeError, ValueError):
+            return None, 'wordCount must be a number'
+        parsed.append({
+            'topic': data['topic'],
+            'format': variant.get('format', 'blog post'),
+            'tone': variant.get('tone', 'professional'),
+            'wordCount': word_count
+        })
+    return parsed, None
+
+def variant_result(index, variant, start, content=None, duration_ms=None, cached=False, error=None):
+    """One entry of a batch response; ``latency_ms`` includes queueing."""
+    result = {
+        'index': index,
+        'format': variant['format'],
+        'tone': variant['tone'],
+        'wordCount': variant['wordCount'],
+        'status': 'error' if error else 'ok',
+        'latency_ms': int((time.time() - start) * 1000)
+    }
+    if error:
+        result['error'] = error
+    else:
+        result.update({'content': content, 'cached': cached, 'duration_ms': duration_ms})
+    return result
+
+def variant_error(error):
+    """Client-facing message for a failed variant."""
+    if isinstance(error, Overloaded):
+        return 'Server busy, please try again'
+    return str(error) or error.__class__.__name__
+
+def batch_summary(results, start):
+    failed = sum(1 for result in results if result['status'] == 'error')
+    return {'succeeded': len(results) - failed, 'failed': failed, 'wall_ms': int((time.time() - start) * 1000)}
+
+def run_variant(index, variant, use_cache, start):
+    try:
+        content, duration_ms, cached = cached_completion(post_completion_args(variant), use_cache=use_cache)
+        return variant_result(index, variant, start, content, duration_ms, cached)
+    except Exception as e:
+        logger.warning(f"Post variant {index} failed: {e.__class__.__name__}: {e}")
+        return variant_result(index, variant, start, error=variant_error(e))
+
+def run_batch(variants, use_cache):
+    """Yield variant results in completion order, POST_BATCH_CONCURRENCY at a time."""
+    start = time.time()
+    executor = ThreadPoolExecutor(max_workers=min(len(variants), POST_BATCH_CONCURRENCY), thread_name_prefix='post-batch')
+    try:
+        futures = [executor.submit(run_variant, index, variant, use_cache, start) for index, variant in enumerate(variants)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Cliente desconectou: variantes que ainda não começaram são canceladas
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def warm_up():
+    llm_gateway.warm_up()
 
 @post_bp.route('/generate', methods=['POST'])
+@single_flight
 def generate_post():
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-            
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         data = request.json
         if not data or 'topic' not in data:
             return jsonify({'error': 'Topic is required'}), 400
 
-        response = client.chat.completions.create(
-            model=os.getenv('AZURE_OPENAI_DEPLOYMENT'),
-            messages=[
-                {"role": "system", "content": "You are a professional content writer, expecialist in social media, entire thing that you ask need to be very smart, attetion on it."},
-                {"role": "user", "content": f"Create a {data.get('format', 'blog post')} about {data['topic']} "
-                                          f"in a {data.get('tone', 'professional')} tone, "
-                                          f"with approximately {data.get('wordCount', 300)} words."}
-                                          
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
+        # Release the request's DB connection before the slow upstream call
+        commit_request_session()
+
+        try:
+            content, duration_ms, cached = cached_completion(
+                post_completion_args(data), use_cache=not cache_bypassed(request.headers)
+            )
+        except Overloaded as e:
+            return overloaded_response(e)
 
         return jsonify({
-            'content': response.choices[0].message.content
+            'content': content,
+            'cached': cached
         })
 
     except Exception as e:
         logger.exception("Error generating post")
         return jsonify({'error': str(e)}), 500
+
+@post_bp.route('/generate/batch', methods=['POST'])
+def generate_post_batch():
+    """Several variants of one post generated concurrently.
+
+    Body: ``{"topic": ..., "variants": [{"format", "tone", "wordCount"}, ...]}``.
+    A failed variant is reported in its own entry; the batch still succeeds.
+    """
+    try:
+        variants, error = parse_batch(request.json)
+        if error:
+            return jsonify({'error': error}), 400
+
+        commit_request_session()
+        start = time.time()
+        results = sorted(run_batch(variants, not cache_bypassed(request.headers)), key=lambda result: result['index'])
+        return jsonify({'results': results, **batch_summary(results, start)})
+
+    except Exception as e:
+        logger.exception("Error generating post batch")
+        return jsonify({'error': str(e)}), 500
+
+@post_bp.route('/generate/batch/stream', methods=['POST'])
+def generate_post_batch_stream():
+    """Like /generate/batch, but each variant is sent as an SSE ``variant``
+    event as soon as it completes, followed by a ``done`` event."""
+    try:
+        variants, error = parse_batch(request.json)
+        if error:
+            return jsonify({'error': error}), 400
+
+        commit_request_session()
+        use_cache = not cache_bypassed(request.headers)
+
+        def generate():
+            start = time.time()
+            results = []
+            yield sse_event({'variants': len(variants)}, 'start')
+            for result in run_batch(variants, use_cache):
+                results.append(result)
+                yield sse_event(result, 'variant')
+            yield sse_event(batch_summary(results, start), 'done')
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    except Exception as e:
+        logger.exception("Error generating post batch")
+        return jsonify({'error': str(e)}), 500
@@ -1,5 +1,6 @@
-from flask import Blueprint, request, jsonify
-from data.db import verify_token, get_posts_history, create_post, update_post, delete_post
+from flask import Blueprint, request, jsonify, g
+from data.db import get_posts_history, create_post, update_post, delete_post
+from routes.pagination import get_page_args
 import logging
 
 post_history_bp = Blueprint('post_history', __name__, url_prefix='/post')
@@ -8,17 +9,12 @@ logger = logging.getLogger(__name__)
 @post_history_bp.route('/history', methods=['GET'])
 def get_history():
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
+        user = g.user
 
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
-
-        posts = get_posts_history(user.id)
+        limit, cursor = get_page_args(default_limit=20, max_limit=100)
+        posts, next_cursor = get_posts_history(user.id, limit=limit, cursor=cursor)
         if not posts:
-            return jsonify({'posts': []}), 200
+            return jsonify({'posts': [], 'next_cursor': None}), 200
 
         return jsonify({
             'posts': [{
@@ -29,9 +25,12 @@ def get_history():
                 'tone': post.tone,
                 'word_count': post.word_count,
                 'created_at': post.created_at.isoformat() if hasattr(post.created_at, 'isoformat') else str(post.created_at)
-            } for post in posts]
+            } for post in posts],
+            'next_cursor': next_cursor
         }), 200
 
+    except ValueError as e:
+        return jsonify({'error': str(e), 'posts': []}), 400
     except Exception as e:
         logger.exception("Error fetching post history")
         return jsonify({'error': str(e), 'posts': []}), 500
@@ -39,13 +38,7 @@ def get_history():
 @post_history_bp.route('/save', methods=['POST'])
 def save_post():
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         data = request.json
         if not data:
@@ -93,13 +86,7 @@ def save_post():
 @post_history_bp.route('/update/<int:post_id>', methods=['PUT'])
 def update_existing_post(post_id):
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         data = request.json
         topic = data.get('topic')
@@ -126,13 +113,7 @@ def update_existing_post(post_id):
 @post_history_bp.route('/delete/<int:post_id>', methods=['DELETE'])
 def delete_existing_post(post_id):
     try:
-        token = request.cookies.get('session')
-        if not token:
-            return jsonify({'error': 'No authentication cookie'}), 401
-
-        user = verify_token(token)
-        if not user:
-            return jsonify({'error': 'Invalid session'}), 401
+        user = g.user
 
         success = delete_post(post_id, user.id)
         if not success:
@@ -0,0 +1,42 @@
+from flask import Blueprint, request, jsonify, g
+from data.search import search_chat_messages, search_posts
+from routes.pagination import get_page_args
+import logging
+
+search_bp = Blueprint('search', __name__)
+logger = logging.getLogger(__name__)
+
+SEARCH_TYPES = {
+    'messages': search_chat_messages,
+    'posts': search_posts,
+}
+
+@search_bp.route('/search', methods=['GET'])
+def search():
+    """Busca nas mensagens do chat e nos posts salvos do usuário.
+
+    ``?q=...&type=messages|posts|all``. Cada tipo tem sua própria página e
+    ``next_cursor``; para continuar, repita a busca com ``type`` e ``cursor``.
+    """
+    try:
+        user = g.user
+        query = request.args.get('q', '')
+        search_type = request.args.get('type', 'all')
+        if search_type != 'all' and search_type not in SEARCH_TYPES:
+            return jsonify({'error': 'Invalid type'}), 400
+        limit, cursor = get_page_args(default_limit=20, max_limit=50)
+        if cursor and search_type == 'all':
+            return jsonify({'error': 'A cursor requires type=messages or type=posts'}), 400
+
+        types = SEARCH_TYPES if search_type == 'all' else [search_type]
+        results = {}
+        for name in types:
+            hits, next_cursor = SEARCH_TYPES[name](user.id, query, limit=limit, cursor=cursor)
+            results[name] = {'results': hits, 'next_cursor': next_cursor}
+        return jsonify({'query': query, **results}), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception:
+        logger.exception("Error searching")
+        return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,68 @@
+from functools import wraps
+from flask import request, jsonify, g, Response, make_response
+from services.single_flight import (
+    COALESCED_HEADER, REPLAYED_HEADER, IdempotencyKeyReused, SingleFlightTimeout, deduplicate, idempotency_key,
+    stored_response
+)
+import hashlib
+
+
+def request_payload():
+    """What identifies a generation request: the JSON body, or form fields
+    plus the content hash of each uploaded file (multipart boundaries differ
+    between otherwise identical submissions)."""
+    if request.is_json:
+        return request.get_json(silent=True)
+    files = []
+    for name, upload in request.files.items(multi=True):
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: upload.stream.read(64 * 1024), b''):
+            digest.update(chunk)
+        upload.stream.seek(0)
+        files.append([name, upload.filename, digest.hexdigest()])
+    return {'form': sorted(request.form.items(multi=True)), 'files': sorted(files)}
+
+
+def to_response(stored, replayed=False, coalesced=False):
+    response = Response(stored['body'], status=stored['status'], content_type=stored['content_type'])
+    response.headers.update(stored['headers'])
+    if replayed:
+        response.headers[REPLAYED_HEADER] = 'true'
+    if coalesced:
+        response.headers[COALESCED_HEADER] = 'coalesced'
+    return response
+
+
+def single_flight(view):
+    """Deduplicate a generation endpoint (see services.single_flight).
+
+    Concurrent identical requests from the same user share one execution of
+    ``view``, and a retry carrying a known Idempotency-Key gets the recorded
+    response back. Only for views that return a complete (non-streamed)
+    response.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'OPTIONS':
+            return view(*args, **kwargs)
+        try:
+            key = idempotency_key(request.headers)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        def handler(fingerprint):
+            response = make_response(view(*args, **kwargs))
+            return stored_response(
+                response.status_code, response.get_data(as_text=True),
+                response.content_type, response.headers, fingerprint
+            )
+
+        try:
+            stored, replayed, coalesced = deduplicate(g.user.id, request.endpoint, request_payload(), key, handler)
+        except IdempotencyKeyReused as e:
+            return jsonify({'error': str(e)}), 422
+        except SingleFlightTimeout:
+            return jsonify({'error': 'Timed out waiting for an identical request in progress'}), 504
+        return to_response(stored, replayed, coalesced)
+
+    return wrapper
@@ -1,14 +1,19 @@
 from flask import Blueprint, request, jsonify
-from pytrends.request import TrendReq
-import openai
-import os
 
 trends_bp = Blueprint('trends', __name__, url_prefix='/trending')
 
-# Configure sua API key
-openai.api_key = os.getenv("AZURE_OPENAI_API_KEY")
-# Inicializa PyTrends
-pytrends = TrendReq(hl='pt-BR', tz=360)
+# PyTrends (e pandas) só são importados no primeiro uso
+_pytrends = None
+
+def get_pytrends():
+    global _pytrends
+    if _pytrends is None:
+        from pytrends.request import TrendReq
+        _pytrends = TrendReq(hl='pt-BR', tz=360)
+    return _pytrends
+
+def warm_up():
+    get_pytrends()
 
 @trends_bp.route('/', methods=['GET'])
 def get_trending_topics():
@@ -17,6 +22,7 @@ def get_trending_topics():
         return jsonify({'error': 'Missing keyword'}), 400
 
     try:
+        pytrends = get_pytrends()
         pytrends.build_payload([keyword], timeframe='now 7-d')
         related_queries = pytrends.related_queries()
         top_related = related_queries[keyword]['top']
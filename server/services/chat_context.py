@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from data.db import get_conversation_context, get_messages_to_summarize, save_conversation_summary
+from services import metrics
+from services.llm_gateway import complete
+from services.vision import VISION_ENABLED, VISION_HISTORY_IMAGES, VISION_IMAGE_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Orçamento de tokens do histórico enviado ao modelo (sem contar o prompt de
+# sistema nem a resposta). Turnos recentes vão na íntegra; os mais antigos são
+# substituídos por um resumo incremental guardado em conversations.summary.
+CHAT_CONTEXT_TOKENS = int(os.getenv('CHAT_CONTEXT_TOKENS', '2000'))
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv('CHAT_CONTEXT_MAX_MESSAGES', '100'))
+# Só resume quando pelo menos tantas mensagens saíram do orçamento, para não
+# chamar o modelo a cada turno
+CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv('CHAT_SUMMARY_MIN_MESSAGES', '6'))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', '300'))
+CHAT_SUMMARY_WORKERS = int(os.getenv('CHAT_SUMMARY_WORKERS', '2'))
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Você resume conversas entre um usuário e um assistente. Atualize o resumo "
+    "existente com as novas mensagens, mantendo fatos, preferências, decisões "
+    "e perguntas em aberto. Responda apenas com o resumo, de forma concisa."
+)
+
+_executor = ThreadPoolExecutor(max_workers=CHAT_SUMMARY_WORKERS, thread_name_prefix='chat-summary')
+_pending = set()
+_pending_lock = threading.Lock()
+_stats = {'contexts': 0, 'truncated': 0, 'summaries': 0, 'summary_failures': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    with _pending_lock:
+        result['pending_summaries'] = len(_pending)
+    return result
+
+
+metrics.register('chat_context', stats)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) without a tokenizer."""
+    return len(text) // 4 + 1
+
+
+def message_text(message):
+    """Content as sent to the model, with the attached image reference."""
+    if message.get('image_path'):
+        return f"{message['content']}\n[Imagem anexada: {message['image_path']}]"
+    return message['content']
+
+
+def build_context(user_id, conversation_id, prompt_for_ai, budget=CHAT_CONTEXT_TOKENS):
+    """History for the next completion: ``(summary, messages)``.
+
+    ``messages`` (role, content, image_path) are the most recent turns
+    (oldest first) that fit in
+    ``budget`` tokens together with the summary and the new prompt. When
+    enough unsummarized turns fall outside the budget, a background task
+    folds them into the stored summary; until it lands they are just dropped.
+    """
+    if not conversation_id:
+        return None, []
+    try:
+        summary, until_id, recent = get_conversation_context(user_id, conversation_id, CHAT_CONTEXT_MAX_MESSAGES)
+    except Exception as e:
+        logger.exception(f"Error loading chat context: {e}")
+        return None, []
+
+    _count('contexts')
+    remaining = budget - estimate_tokens(prompt_for_ai) - (estimate_tokens(summary) if summary else 0)
+    included = []
+    images = 0
+    for message in recent:
+        cost = estimate_tokens(message_text(message)) + 4
+        if VISION_ENABLED and message.get('image_path') and images < VISION_HISTORY_IMAGES:
+            # Only the newest images are attached (see routes.chat.chat_completion_args)
+            images += 1
+            cost += VISION_IMAGE_TOKENS
+        if cost > remaining:
+            break
+        remaining -= cost
+        included.append(message)
+
+    overflow = recent[len(included):]
+    if overflow:
+        _count('truncated')
+        if len(overflow) >= CHAT_SUMMARY_MIN_MESSAGES:
+            # overflow is newest first: fold everything up to its newest id
+            schedule_summary(user_id, conversation_id, until_id, overflow[0]['id'], summary)
+
+    history = [
+        {'role': m['role'], 'content': message_text(m), 'image_path': m.get('image_path')}
+        for m in reversed(included)
+    ]
+    return summary, history
+
+
+def schedule_summary(user_id, conversation_id, after_id, until_id, summary):
+    with _pending_lock:
+        if conversation_id in _pending:
+            return
+        _pending.add(conversation_id)
+    _executor.submit(_refresh_summary, user_id, conversation_id, after_id, until_id, summary)
+
+
+def _refresh_summary(user_id, conversation_id, after_id, until_id, summary):
+    try:
+        messages = get_messages_to_summarize(user_id, conversation_id, after_id, until_id)
+        if not messages:
+            return
+        transcript = "\n".join(f"{m['role']}: {message_text(m)}" for m in messages)
+        response = complete(
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Resumo atual:\n{summary or '(vazio)'}\n\nNovas mensagens:\n{transcript}"}
+            ],
+            temperature=0.2,
+            max_tokens=CHAT_SUMMARY_MAX_TOKENS
+        )
+        save_conversation_summary(user_id, conversation_id, response.choices[0].message.content, until_id)
+        _count('summaries')
+        logger.info(f"Conversation {conversation_id} summarized up to message {until_id}")
+    except Exception as e:
+        _count('summary_failures')
+        logger.exception(f"Error summarizing conversation {conversation_id}: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(conversation_id)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of queued; maps to HTTP 503."""
+
+    def __init__(self, name, retry_after=1):
+        super().__init__(f"{name} is overloaded")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('event', 'loop', 'granted')
+
+    def __init__(self, event, loop=None):
+        self.event = event
+        self.loop = loop
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded FIFO queue.
+
+    Each success adds ~1 to the limit per limit's worth of calls (additive
+    increase) while the limit is actually in use; only throttling (a 429)
+    multiplies it by ``backoff``. Latencies of completed calls are smoothed
+    per ``latency_class`` (calls of different sizes aren't comparable) and
+    only feed the queue wait estimate. Callers over the limit wait in a
+    queue for at most ``queue_timeout`` seconds; they are shed immediately if
+    the queue is full or the estimated wait already exceeds the timeout.
+    Works for threads (acquire) and asyncio tasks (acquire_async) alike.
+    """
+
+    def __init__(self, name, initial=16, min_limit=1, max_limit=128, queue_max=100, queue_timeout=5.0,
+                 backoff=0.5):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.in_flight = 0
+        self.latency_ewma = {}
+        self.shed = 0
+        self.throttled = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _estimated_wait(self):
+        if not self.latency_ewma:
+            return 0.0
+        latency_ms = sum(self.latency_ewma.values()) / len(self.latency_ewma)
+        return (len(self._waiters) + 1) * latency_ms / 1000 / max(int(self.limit), 1)
+
+    def _enter(self, waiter):
+        """Take a slot, queue ``waiter`` or shed; returns True if acquired."""
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return True
+            if len(self._waiters) >= self.queue_max or self._estimated_wait() > self.queue_timeout:
+                self.shed += 1
+                raise Overloaded(self.name, self._retry_after())
+            self._waiters.append(waiter)
+            return False
+
+    def _abandon(self, waiter):
+        """Timed-out or cancelled waiter: True if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self.shed += 1
+            return False
+
+    def _retry_after(self):
+        return max(1, int(round(self._estimated_wait())))
+
+    def acquire(self):
+        waiter = _Waiter(threading.Event())
+        if self._enter(waiter):
+            return
+        if waiter.event.wait(self.queue_timeout) or self._abandon(waiter):
+            return
+        raise Overloaded(self.name, self._retry_after())
+
+    async def acquire_async(self):
+        waiter = _Waiter(asyncio.Event(), asyncio.get_running_loop())
+        if self._enter(waiter):
+            return
+        try:
+            await asyncio.wait_for(waiter.event.wait(), self.queue_timeout)
+            return
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                return
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release()
+            raise
+        raise Overloaded(self.name, self._retry_after())
+
+    def release(self, succeeded=False, throttled=False, latency_ms=None, latency_class=None):
+        """Free a slot. ``succeeded`` grows the limit, ``throttled`` shrinks it;
+        ``latency_ms`` is the duration of a complete call of ``latency_class``
+        (leave it out for streams: opening one says nothing about its length)."""
+        with self._lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                logger.warning(f"{self.name} throttled; concurrency limit now {int(self.limit)}")
+            elif succeeded:
+                if self.in_flight + 1 >= int(self.limit) / 2:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if latency_ms is not None:
+                    ewma = self.latency_ewma.get(latency_class)
+                    self.latency_ewma[latency_class] = latency_ms if ewma is None else 0.9 * ewma + 0.1 * latency_ms
+            while self._waiters and self.in_flight < int(self.limit):
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self.in_flight += 1
+                waiter.wake()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queue_depth': len(self._waiters),
+                'shed': self.shed,
+                'throttled': self.throttled,
+                'latency_ewma_ms': {str(k): round(v, 1) for k, v in self.latency_ewma.items()}
+            }
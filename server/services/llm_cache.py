@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from data.cache import TTLCache
+from data.db import get_llm_cache_entry, set_llm_cache_entry, commit_request_session
+from services import metrics
+from services.llm_gateway import complete, complete_async
+
+logger = logging.getLogger(__name__)
+
+# Cache de respostas idênticas do modelo. A chave é o hash normalizado de
+# (deployment, mensagens, temperature, max_tokens); o prompt de sistema faz
+# parte das mensagens. Camada em memória (LRU + TTL) e, opcionalmente, uma
+# camada compartilhada entre workers na tabela llm_cache (LLM_CACHE_SHARED=db).
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', '3600'))
+LLM_CACHE_MAX_SIZE = int(os.getenv('LLM_CACHE_MAX_SIZE', '1000'))
+LLM_CACHE_SHARED = os.getenv('LLM_CACHE_SHARED', '')
+
+_memory = TTLCache(maxsize=LLM_CACHE_MAX_SIZE, ttl=LLM_CACHE_TTL)
+_lock = threading.Lock()
+_stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'bypassed': 0, 'saved_ms': 0}
+
+
+def _normalize(content):
+    if not isinstance(content, str):
+        # Multimodal content (text + image parts); image data URLs are deterministic
+        content = json.dumps(content, sort_keys=True)
+    return ' '.join(unicodedata.normalize('NFC', content).split())
+
+
+def cache_key(args):
+    """Hash of the completion arguments that determine the response."""
+    payload = {
+        'model': args.get('model'),
+        'messages': [
+            {'role': m['role'], 'content': _normalize(m['content'])} for m in args['messages']
+        ],
+        'temperature': args.get('temperature'),
+        'max_tokens': args.get('max_tokens')
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def cache_bypassed(headers):
+    """Per-request opt-out: ``Cache-Control: no-cache`` (or no-store)."""
+    value = headers.get('Cache-Control', '').lower()
+    return 'no-cache' in value or 'no-store' in value
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+def lookup(key):
+    """Cached ``{'text', 'duration_ms'}`` from memory, then the shared tier."""
+    entry = _memory.get(key)
+    if entry is None and LLM_CACHE_SHARED == 'db':
+        entry = get_llm_cache_entry(key)
+        # Não segurar a conexão da requisição durante a chamada ao modelo
+        commit_request_session()
+        if entry is not None:
+            _memory.set(key, entry)
+            _count('shared_hits')
+    if entry is None:
+        _count('misses')
+        return None
+    _count('hits')
+    _count('saved_ms', entry.get('duration_ms', 0))
+    return entry
+
+
+def store(key, text, duration_ms):
+    entry = {'text': text, 'duration_ms': duration_ms}
+    _memory.set(key, entry)
+    if LLM_CACHE_SHARED == 'db':
+        set_llm_cache_entry(key, entry, LLM_CACHE_TTL)
+
+
+def cached_completion(args, use_cache=True):
+    """Run ``llm_gateway.complete(**args)`` through the cache.
+
+    Returns ``(text, duration_ms, cached)``; ``duration_ms`` is the upstream
+    time (0 on a hit).
+    """
+    if not LLM_CACHE_ENABLED or not use_cache:
+        if LLM_CACHE_ENABLED:
+            _count('bypassed')
+        use_cache = False
+    else:
+        key = cache_key(args)
+        entry = lookup(key)
+        if entry is not None:
+            return entry['text'], 0, True
+
+    start = time.time()
+    response = complete(**args)
+    duration_ms = int((time.time() - start) * 1000)
+    text = response.choices[0].message.content
+    if use_cache and text:
+        store(key, text, duration_ms)
+    return text, duration_ms, False
+
+
+async def cached_completion_async(args, use_cache=True):
+    """Async counterpart of cached_completion (shared tier runs in a thread)."""
+    from starlette.concurrency import run_in_threadpool
+
+    if not LLM_CACHE_ENABLED or not use_cache:
+        if LLM_CACHE_ENABLED:
+            _count('bypassed')
+        use_cache = False
+    else:
+        key = cache_key(args)
+        entry = await run_in_threadpool(lookup, key) if LLM_CACHE_SHARED == 'db' else lookup(key)
+        if entry is not None:
+            return entry['text'], 0, True
+
+    start = time.time()
+    response = await complete_async(**args)
+    duration_ms = int((time.time() - start) * 1000)
+    text = response.choices[0].message.content
+    if use_cache and text:
+        if LLM_CACHE_SHARED == 'db':
+            await run_in_threadpool(store, key, text, duration_ms)
+        else:
+            store(key, text, duration_ms)
+    return text, duration_ms, False
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+    lookups = result['hits'] + result['misses']
+    result['hit_ratio'] = round(result['hits'] / lookups, 4) if lookups else 0.0
+    result['enabled'] = LLM_CACHE_ENABLED
+    result['shared'] = LLM_CACHE_SHARED or None
+    result['memory'] = _memory.stats()
+    return result
+
+
+metrics.register('llm_cache', stats)
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from services import metrics
+from services.limiter import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+# Ponto único de acesso ao Azure OpenAI: um cliente (sync e async) por
+# processo com pool HTTP compartilhado, timeouts por chamada e retry com
+# backoff exponencial + jitter em 429/5xx, respeitando Retry-After.
+AZURE_OPENAI_API_VERSION = os.getenv('AZURE_OPENAI_API_VERSION', '2024-12-01-preview')
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '20'))
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', '100'))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', '20'))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv('LLM_POOL_KEEPALIVE_EXPIRY', '60'))
+LATENCY_WINDOW = 500
+
+# Limite de concorrência adaptativo (AIMD) por deployment, por processo.
+# Acima do limite as chamadas esperam na fila até LLM_QUEUE_TIMEOUT segundos;
+# depois disso (ou com a fila cheia) a requisição recebe 503 na hora.
+LLM_LIMITER_ENABLED = os.getenv('LLM_LIMITER_ENABLED', '1') == '1'
+LLM_LIMIT_INITIAL = int(os.getenv('LLM_LIMIT_INITIAL', '16'))
+LLM_LIMIT_MIN = int(os.getenv('LLM_LIMIT_MIN', '1'))
+LLM_LIMIT_MAX = int(os.getenv('LLM_LIMIT_MAX', '128'))
+LLM_QUEUE_MAX = int(os.getenv('LLM_QUEUE_MAX', '100'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '5'))
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+_limiters = {}
+
+
+def default_deployment():
+    return os.getenv('AZURE_OPENAI_DEPLOYMENT')
+
+
+def _http_options():
+    import httpx
+    return {
+        'limits': httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+        ),
+        'timeout': httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    }
+
+
+def _client_options():
+    return {
+        'api_key': os.getenv('AZURE_OPENAI_API_KEY'),
+        'api_version': AZURE_OPENAI_API_VERSION,
+        'azure_endpoint': os.getenv('AZURE_OPENAI_API_ENDPOINT'),
+        # Retries are done here, so they can honor Retry-After and be counted
+        'max_retries': 0
+    }
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                from openai import AzureOpenAI
+                _client = AzureOpenAI(http_client=httpx.Client(**_http_options()), **_client_options())
+    return _client
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                import httpx
+                from openai import AsyncAzureOpenAI
+                _async_client = AsyncAzureOpenAI(http_client=httpx.AsyncClient(**_http_options()), **_client_options())
+    return _async_client
+
+
+def warm_up():
+    get_client()
+
+
+class DeploymentStats:
+    """Request, retry and error counters plus a latency window per deployment."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deployments = {}
+
+    def _entry(self, deployment):
+        entry = self._deployments.get(deployment)
+        if entry is None:
+            entry = self._deployments[deployment] = {
+                'requests': 0, 'errors': 0, 'retries': 0, 'throttled': 0,
+                'latencies': deque(maxlen=LATENCY_WINDOW)
+            }
+        return entry
+
+    def record(self, deployment, latency_ms=None, error=False, retries=0, throttled=0):
+        with self._lock:
+            entry = self._entry(deployment)
+            entry['requests'] += 1
+            entry['retries'] += retries
+            entry['throttled'] += throttled
+            if error:
+                entry['errors'] += 1
+            elif latency_ms is not None:
+                entry['latencies'].append(latency_ms)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for deployment, entry in self._deployments.items():
+                latencies = sorted(entry['latencies'])
+                result[deployment or 'default'] = {
+                    'requests': entry['requests'],
+                    'errors': entry['errors'],
+                    'retries': entry['retries'],
+                    'throttled': entry['throttled'],
+                    'error_rate': round(entry['errors'] / entry['requests'], 4) if entry['requests'] else 0.0,
+                    'p50_ms': _percentile(latencies, 0.50),
+                    'p95_ms': _percentile(latencies, 0.95),
+                    'p99_ms': _percentile(latencies, 0.99)
+                }
+            return result
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+deployment_stats = DeploymentStats()
+metrics.register('llm', deployment_stats.snapshot)
+
+
+def _status_code(error):
+    return getattr(error, 'status_code', None)
+
+
+def is_retryable(error):
+    """429, 408/409 and 5xx responses, plus connection errors and timeouts."""
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+def retry_after(error):
+    """Delay requested by the server (retry-after-ms / Retry-After), or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, error):
+    """Retry-After when given, else full-jitter exponential backoff."""
+    requested = retry_after(error)
+    if requested is not None:
+        # Um pouco de jitter para os workers não voltarem todos juntos
+        return min(requested, LLM_BACKOFF_MAX) + random.uniform(0, LLM_BACKOFF_BASE)
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def get_limiter(deployment):
+    limiter = _limiters.get(deployment)
+    if limiter is None:
+        with _client_lock:
+            limiter = _limiters.get(deployment)
+            if limiter is None:
+                limiter = _limiters[deployment] = AdaptiveLimiter(
+                    f"LLM deployment {deployment}",
+                    initial=LLM_LIMIT_INITIAL,
+                    min_limit=LLM_LIMIT_MIN,
+                    max_limit=LLM_LIMIT_MAX,
+                    queue_max=LLM_QUEUE_MAX,
+                    queue_timeout=LLM_QUEUE_TIMEOUT
+                )
+    return limiter
+
+
+def limiter_stats():
+    return {deployment or 'default': limiter.stats() for deployment, limiter in list(_limiters.items())}
+
+
+metrics.register('llm_limiter', limiter_stats)
+
+
+class _LimitedStream:
+    """Holds the limiter slot until the stream is exhausted or closed."""
+
+    def __init__(self, stream, limiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._limiter.release(succeeded=True)
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
+
+
+class _AsyncLimitedStream(_LimitedStream):
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._limiter.release(succeeded=True)
+        if hasattr(self._stream, 'close'):
+            await self._stream.close()
+
+
+def complete(timeout=None, **args):
+    """``chat.completions.create(**args)`` with retries, limiting and metrics.
+
+    ``model`` defaults to AZURE_OPENAI_DEPLOYMENT; ``timeout`` overrides
+    LLM_TIMEOUT for this call. Each attempt holds a slot of the deployment's
+    AdaptiveLimiter (until the stream is closed, with ``stream=True``) and
+    raises services.limiter.Overloaded when shed. With ``stream=True`` only
+    opening the stream is retried.
+    """
+    args.setdefault('model', default_deployment())
+    if timeout is not None:
+        args['timeout'] = timeout
+    deployment = args['model']
+    limiter = get_limiter(deployment) if LLM_LIMITER_ENABLED else None
+    retries = throttled = 0
+    start = time.time()
+    while True:
+        if limiter:
+            limiter.acquire()
+        attempt_start = time.time()
+        try:
+            response = get_client().chat.completions.create(**args)
+        except Exception as e:
+            if limiter:
+                limiter.release(throttled=_status_code(e) == 429)
+            if _status_code(e) == 429:
+                throttled += 1
+            if retries >= LLM_MAX_RETRIES or not is_retryable(e):
+                deployment_stats.record(deployment, error=True, retries=retries, throttled=throttled)
+                raise
+            delay = backoff_delay(retries, e)
+            retries += 1
+            logger.warning(f"LLM call to {deployment} failed ({e.__class__.__name__}); retry {retries} in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        attempt_ms = int((time.time() - attempt_start) * 1000)
+        deployment_stats.record(deployment, int((time.time() - start) * 1000), retries=retries, throttled=throttled)
+        if limiter:
+            if args.get('stream'):
+                return _LimitedStream(response, limiter)
+            # Latência comparável só entre chamadas do mesmo tamanho
+            limiter.release(succeeded=True, latency_ms=attempt_ms, latency_class=args.get('max_tokens'))
+        return response
+
+
+async def complete_async(timeout=None, **args):
+    """Async counterpart of complete(); waits and backoff sleeps don't block the loop."""
+    args.setdefault('model', default_deployment())
+    if timeout is not None:
+        args['timeout'] = timeout
+    deployment = args['model']
+    limiter = get_limiter(deployment) if LLM_LIMITER_ENABLED else None
+    retries = throttled = 0
+    start = time.time()
+    while True:
+        if limiter:
+            await limiter.acquire_async()
+        attempt_start = time.time()
+        try:
+            response = await get_async_client().chat.completions.create(**args)
+        except BaseException as e:
+            if limiter:
+                limiter.release(throttled=_status_code(e) == 429)
+            if not isinstance(e, Exception):
+                raise
+            if _status_code(e) == 429:
+                throttled += 1
+            if retries >= LLM_MAX_RETRIES or not is_retryable(e):
+                deployment_stats.record(deployment, error=True, retries=retries, throttled=throttled)
+                raise
+            delay = backoff_delay(retries, e)
+            retries += 1
+            logger.warning(f"LLM call to {deployment} failed ({e.__class__.__name__}); retry {retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        attempt_ms = int((time.time() - attempt_start) * 1000)
+        deployment_stats.record(deployment, int((time.time() - start) * 1000), retries=retries, throttled=throttled)
+        if limiter:
+            if args.get('stream'):
+                return _AsyncLimitedStream(response, limiter)
+            # Latência comparável só entre chamadas do mesmo tamanho
+            limiter.release(succeeded=True, latency_ms=attempt_ms, latency_class=args.get('max_tokens'))
+        return response
@@ -0,0 +1,23 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# name -> callable returning a JSON-serializable dict
+_providers = {}
+
+
+def register(name, provider):
+    """Register a stats provider exposed under ``name`` on /metrics."""
+    _providers[name] = provider
+
+
+def snapshot():
+    """Collect the current value of every registered provider."""
+    result = {}
+    for name, provider in _providers.items():
+        try:
+            result[name] = provider()
+        except Exception as e:
+            logger.exception(f"Error collecting metrics for {name}: {e}")
+            result[name] = {'error': str(e)}
+    return result
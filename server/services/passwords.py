@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Formato do werkzeug: 'pbkdf2:sha256:<iterações>' ou 'scrypt:<n>:<r>:<p>'
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', '16'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full, or a job times out."""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small bounded thread pool.
+
+    hashlib's PBKDF2/scrypt release the GIL, so the pool caps how many CPU
+    cores hashing can take from a worker process. At most ``workers`` jobs
+    run at once and ``queue_limit`` more may wait; beyond that callers get
+    PasswordHasherBusy immediately instead of piling up behind the CPU.
+    """
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 queue_limit=PASSWORD_HASH_QUEUE_LIMIT, timeout=PASSWORD_HASH_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self._method_prefix = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rehashed = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy("Password hashing pool is saturated")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Ainda na fila: não vale mais a pena calcular
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise PasswordHasherBusy(f"Password hashing took longer than {self.timeout}s")
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when a stored hash was produced with different parameters."""
+        if self._method_prefix is None:
+            # Werkzeug fills in defaults (e.g. iterations) when the method is
+            # abbreviated, so derive the exact prefix from a real hash once.
+            self._method_prefix = generate_password_hash('', method=self.method, salt_length=1).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def stats(self):
+        return {
+            'method': self.method,
+            'workers': self.workers,
+            'queue_limit': self.queue_limit,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'rehashed': self.rehashed
+        }
+
+
+hasher = PasswordHasher()
+metrics.register('password_hashing', hasher.stats)
+
+
+def hash_password(password):
+    return hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    return hasher.verify(password_hash, password)
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import unicodedata
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from data.cache import TTLCache
+from data.db import get_llm_cache_entry, set_llm_cache_entry
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requisições de geração duplicadas (duplo clique, retry do frontend):
+#  - single-flight: enquanto uma requisição idêntica (usuário + rota + payload
+#    normalizado) está em andamento, as cópias esperam e recebem a mesma
+#    resposta em vez de chamar o modelo de novo;
+#  - Idempotency-Key: a resposta fica guardada por IDEMPOTENCY_TTL segundos e
+#    um retry com a mesma chave recebe a resposta gravada. Com
+#    IDEMPOTENCY_SHARED=db o registro vai para a tabela llm_cache e vale
+#    entre workers; senão fica só na memória do processo.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', '1') == '1'
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '120'))
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '600'))
+IDEMPOTENCY_MAX_SIZE = int(os.getenv('IDEMPOTENCY_MAX_SIZE', '10000'))
+IDEMPOTENCY_SHARED = os.getenv('IDEMPOTENCY_SHARED', '')
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Cabeçalhos de resposta
+REPLAYED_HEADER = 'Idempotent-Replayed'
+COALESCED_HEADER = 'X-Single-Flight'
+# Cabeçalhos da resposta original repetidos nas cópias
+STORED_HEADERS = ('Retry-After',)
+
+
+class IdempotencyKeyReused(ValueError):
+    """The Idempotency-Key was already used with a different request (HTTP 422)."""
+
+
+class SingleFlightTimeout(Exception):
+    """Waited SINGLE_FLIGHT_TIMEOUT seconds on an identical request in flight (HTTP 504)."""
+
+
+class _LeaderGone(Exception):
+    """The call being waited on was cancelled; a waiter takes over."""
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return ' '.join(unicodedata.normalize('NFC', value).split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def request_fingerprint(user_id, endpoint, payload):
+    """Hash of user, endpoint and the normalized payload."""
+    encoded = json.dumps(
+        [user_id, endpoint, _normalize(payload)],
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def idempotency_key(headers):
+    """The client's Idempotency-Key, or None; ValueError if malformed."""
+    value = (headers.get(IDEMPOTENCY_HEADER) or '').strip()
+    if not value:
+        return None
+    if len(value) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise ValueError(f"{IDEMPOTENCY_HEADER} longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+    return value
+
+
+def stored_response(status, body, content_type, headers, fingerprint):
+    """JSON-serializable response shared with waiters and idempotent retries."""
+    return {
+        'status': status,
+        'body': body,
+        'content_type': content_type,
+        'headers': {name: headers[name] for name in STORED_HEADERS if name in headers},
+        'fingerprint': fingerprint
+    }
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one.
+
+    The first caller (leader) runs the function; callers arriving while it is
+    in flight wait for its result (or exception). Threads and asyncio tasks
+    share the same in-flight table.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, fn):
+        """``(fn(), coalesced)``; waiters get the leader's result."""
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result(timeout=SINGLE_FLIGHT_TIMEOUT), True
+                except FutureTimeoutError:
+                    raise SingleFlightTimeout()
+                except _LeaderGone:
+                    continue
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._finish(key, future, error=_LeaderGone())
+                raise
+            self._finish(key, future, result)
+            return result, False
+
+    async def do_async(self, key, fn):
+        """Async ``do``: ``fn`` is a coroutine function."""
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    # shield: o cancelamento/timeout de quem espera não cancela o Future compartilhado
+                    waiter = asyncio.shield(asyncio.wrap_future(future))
+                    return await asyncio.wait_for(waiter, SINGLE_FLIGHT_TIMEOUT), True
+                except asyncio.TimeoutError:
+                    raise SingleFlightTimeout()
+                except _LeaderGone:
+                    continue
+            try:
+                result = await fn()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                # Cancelado (cliente desconectou): quem espera assume a chamada
+                self._finish(key, future, error=_LeaderGone())
+                raise
+            self._finish(key, future, result)
+            return result, False
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+flights = SingleFlight()
+_responses = TTLCache(maxsize=IDEMPOTENCY_MAX_SIZE, ttl=IDEMPOTENCY_TTL)
+_stats = {'replayed': 0, 'stored': 0, 'key_reused': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    result = flights.stats()
+    with _stats_lock:
+        result.update(_stats)
+    result['idempotency'] = _responses.stats()
+    return result
+
+
+metrics.register('single_flight', stats)
+
+
+def _idempotency_record_key(user_id, endpoint, key):
+    return hashlib.sha256(f"idempotency:{user_id}:{endpoint}:{key}".encode('utf-8')).hexdigest()
+
+
+def _lookup(record_key):
+    response = _responses.get(record_key)
+    if response is None and IDEMPOTENCY_SHARED == 'db':
+        response = get_llm_cache_entry(record_key)
+        if response is not None:
+            _responses.set(record_key, response)
+    return response
+
+
+def _store(record_key, response):
+    _responses.set(record_key, response)
+    if IDEMPOTENCY_SHARED == 'db':
+        set_llm_cache_entry(record_key, response, IDEMPOTENCY_TTL)
+    _count('stored')
+
+
+def _check_fingerprint(response, fingerprint):
+    if response['fingerprint'] != fingerprint:
+        _count('key_reused')
+        raise IdempotencyKeyReused(f"{IDEMPOTENCY_HEADER} was already used for a different request")
+
+
+def _keys(user_id, endpoint, payload, key):
+    """``(fingerprint, record_key, flight_key)`` of a request."""
+    fingerprint = request_fingerprint(user_id, endpoint, payload)
+    record_key = _idempotency_record_key(user_id, endpoint, key) if key else None
+    # Com Idempotency-Key, as duplicatas são as requisições com a mesma chave
+    return fingerprint, record_key, record_key or fingerprint
+
+
+def _replayed(response, fingerprint):
+    _check_fingerprint(response, fingerprint)
+    _count('replayed')
+    return response, True, False
+
+
+def _shared(response, fingerprint, record_key, coalesced):
+    if coalesced and record_key:
+        _check_fingerprint(response, fingerprint)
+    return response, False, coalesced
+
+
+def deduplicate(user_id, endpoint, payload, key, handler):
+    """Run ``handler(fingerprint)`` (returning a stored_response) at most once.
+
+    Returns ``(response, replayed, coalesced)``: ``replayed`` when served from
+    an Idempotency-Key record, ``coalesced`` when it came from an identical
+    request that was already in flight. Responses with status < 500 are
+    recorded under the key. Raises IdempotencyKeyReused, and
+    SingleFlightTimeout when the identical request in flight takes too long.
+    """
+    fingerprint, record_key, flight_key = _keys(user_id, endpoint, payload, key)
+    if record_key:
+        response = _lookup(record_key)
+        if response is not None:
+            return _replayed(response, fingerprint)
+
+    def lead():
+        response = handler(fingerprint)
+        if record_key and response['status'] < 500:
+            _store(record_key, response)
+        return response
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return lead(), False, False
+    response, coalesced = flights.do(flight_key, lead)
+    return _shared(response, fingerprint, record_key, coalesced)
+
+
+async def deduplicate_async(user_id, endpoint, payload, key, handler):
+    """Async ``deduplicate``; ``handler`` is a coroutine function."""
+    from starlette.concurrency import run_in_threadpool
+
+    fingerprint, record_key, flight_key = _keys(user_id, endpoint, payload, key)
+    shared = IDEMPOTENCY_SHARED == 'db'
+    if record_key:
+        response = await run_in_threadpool(_lookup, record_key) if shared else _lookup(record_key)
+        if response is not None:
+            return _replayed(response, fingerprint)
+
+    async def lead():
+        response = await handler(fingerprint)
+        if record_key and response['status'] < 500:
+            if shared:
+                await run_in_threadpool(_store, record_key, response)
+            else:
+                _store(record_key, response)
+        return response
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return await lead(), False, False
+    response, coalesced = await flights.do_async(flight_key, lead)
+    return _shared(response, fingerprint, record_key, coalesced)
@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from werkzeug.utils import secure_filename
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Anexos do chat são guardados pelo SHA-256 do conteúdo
+# (uploads/ab/abcdef...png): arquivos iguais são gravados uma vez só e o nome
+# nunca colide entre usuários. Como o conteúdo de um nome nunca muda, ele pode
+# ser servido com ETag forte e Cache-Control immutable.
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads'))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Extensões servidas com o content-type correspondente; as demais ficam sem
+# extensão e saem como application/octet-stream
+ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+
+CONTENT_NAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)?$')
+
+_stats = {'stored': 0, 'deduplicated': 0, 'bytes_written': 0}
+metrics.register('uploads', lambda: dict(_stats))
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def content_path(name):
+    """Absolute path of a content-addressed upload, or None for other names."""
+    match = CONTENT_NAME.match(name)
+    if not match:
+        return None
+    return os.path.join(UPLOAD_DIR, match.group(1)[:2], name)
+
+
+def legacy_path(name):
+    """Flat ``uploads/<secure_filename>`` files written before hashing."""
+    safe = secure_filename(name)
+    if not safe or safe != name:
+        return None
+    return os.path.join(UPLOAD_DIR, safe)
+
+
+def save_upload(stream, filename):
+    """Copy ``stream`` to the store while hashing it; returns the stored name.
+
+    The data goes to a temporary file in UPLOAD_DIR and is renamed into place
+    atomically, or discarded if the same content is already stored.
+    Raises UploadTooLarge past UPLOAD_MAX_BYTES.
+    """
+    extension = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        extension = ''
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise UploadTooLarge(f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+                digest.update(chunk)
+                tmp.write(chunk)
+
+        name = f"{digest.hexdigest()}{extension}"
+        path = content_path(name)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            _stats['deduplicated'] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+            _stats['stored'] += 1
+            _stats['bytes_written'] += size
+        return name
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,136 @@
+import base64
+import io
+import logging
+import os
+import threading
+from data.cache import TTLCache
+from services import metrics
+from services.uploads import UPLOAD_DIR, content_path
+
+logger = logging.getLogger(__name__)
+
+# Imagens anexadas ao chat são enviadas ao modelo como entrada de visão, mas
+# antes reduzidas e recodificadas (JPEG) para não inflar o corpo da
+# requisição. O resultado fica em cache pelo hash do conteúdo: em memória e
+# em disco (uploads/.vision), então turnos seguintes não reprocessam a imagem.
+# Ligado por padrão só com um deployment de visão configurado: o deployment
+# principal pode não aceitar image_url (VISION_ENABLED=1 força o uso dele)
+VISION_DEPLOYMENT = os.getenv('AZURE_OPENAI_VISION_DEPLOYMENT')
+VISION_ENABLED = os.getenv('VISION_ENABLED', '1' if VISION_DEPLOYMENT else '0') == '1'
+VISION_MAX_SIDE = int(os.getenv('VISION_MAX_SIDE', '1024'))
+VISION_MAX_BYTES = int(os.getenv('VISION_MAX_BYTES', str(512 * 1024)))
+VISION_JPEG_QUALITY = int(os.getenv('VISION_JPEG_QUALITY', '85'))
+VISION_DETAIL = os.getenv('VISION_DETAIL', 'auto')
+# Quantas imagens de turnos anteriores acompanham o histórico
+VISION_HISTORY_IMAGES = int(os.getenv('VISION_HISTORY_IMAGES', '1'))
+# Custo aproximado de uma imagem no orçamento de tokens do contexto
+VISION_IMAGE_TOKENS = int(os.getenv('VISION_IMAGE_TOKENS', '800'))
+
+VISION_CACHE_DIR = os.path.join(UPLOAD_DIR, '.vision')
+MIN_JPEG_QUALITY = 40
+
+_memory = TTLCache(maxsize=int(os.getenv('VISION_CACHE_MAX_SIZE', '64')), ttl=3600)
+_stats = {'encoded': 0, 'disk_hits': 0, 'failures': 0, 'bytes_in': 0, 'bytes_out': 0}
+_lock = threading.Lock()
+
+
+def vision_deployment():
+    return VISION_DEPLOYMENT or os.getenv('AZURE_OPENAI_DEPLOYMENT')
+
+
+def _cache_path(name):
+    digest = name.split('.', 1)[0]
+    return os.path.join(VISION_CACHE_DIR, f"{digest}-{VISION_MAX_SIDE}-{VISION_MAX_BYTES}-q{VISION_JPEG_QUALITY}.jpg")
+
+
+def downscale(data):
+    """Resize to VISION_MAX_SIDE and re-encode as JPEG under VISION_MAX_BYTES."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.seek(0)  # primeiro quadro de GIFs animados
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+
+        quality = VISION_JPEG_QUALITY
+        while True:
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= VISION_MAX_BYTES or quality <= MIN_JPEG_QUALITY:
+                return buffer.getvalue()
+            quality -= 10
+
+
+def encoded_image(name):
+    """JPEG bytes for a stored upload, from cache when possible; None if unusable."""
+    cached = _memory.get(name)
+    if cached is not None:
+        return cached
+
+    source = content_path(name)
+    if source is None or not os.path.isfile(source):
+        return None
+
+    target = _cache_path(name)
+    if os.path.isfile(target):
+        with open(target, 'rb') as f:
+            encoded = f.read()
+        with _lock:
+            _stats['disk_hits'] += 1
+    else:
+        try:
+            with open(source, 'rb') as f:
+                data = f.read()
+            encoded = downscale(data)
+        except Exception as e:
+            with _lock:
+                _stats['failures'] += 1
+            logger.warning(f"Could not prepare image {name} for vision: {e}")
+            return None
+        os.makedirs(VISION_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded)
+        os.replace(tmp_path, target)
+        with _lock:
+            _stats['encoded'] += 1
+            _stats['bytes_in'] += len(data)
+            _stats['bytes_out'] += len(encoded)
+
+    _memory.set(name, encoded)
+    return encoded
+
+
+def image_part(name):
+    """``image_url`` content part for the chat completions API, or None."""
+    encoded = encoded_image(name)
+    if encoded is None:
+        return None
+    url = 'data:image/jpeg;base64,' + base64.b64encode(encoded).decode('ascii')
+    return {'type': 'image_url', 'image_url': {'url': url, 'detail': VISION_DETAIL}}
+
+
+def vision_content(text, image_path):
+    """Message content with the image attached, or plain text if it can't be."""
+    part = image_part(image_path) if VISION_ENABLED and image_path else None
+    if part is None:
+        return text
+    return [{'type': 'text', 'text': text}, part]
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+    result['enabled'] = VISION_ENABLED
+    result['memory'] = _memory.stats()
+    return result
+
+
+metrics.register('vision', stats)